@@ -1,77 +1,71 @@
 # import libraries
+import startup  # first, so that --profile-startup can time the imports below
 from dash import dcc, html, Dash, dash_table, callback, Input, Output, State, no_update
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
+from dash import DiskcacheManager
+import diskcache
 import dash_bootstrap_components as dbc
 from dash.dash_table.Format import Format, Symbol, Scheme
 from dash.exceptions import PreventUpdate
+from dash._utils import to_json
 
-import datetime
-import base64
-import io
+import json
+import os
+import threading
 
 # import components
-from preprocess import preprocess_listings, preprocess_stats
+from schema import to_records
+from upload import MAX_UPLOAD_BYTES, map_uploads
+from ingest import stage_uploads
+from dataset import DatasetStore
+from kpi import KpiEngine
+from brokers import DEFAULT_BROKER, broker_index, table_columns
+from cache import ByteLRUCache, frame_version
+from listings_frame import closed_sales_cache
+from listings_index import filter_cache
+from trendlines import trendline_cache
+import metrics
 from create_charts import *
 
 
 css = [
     "https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/css/bootstrap.min.css",
 ]
+# background callbacks (the upload ingest) run in worker processes, with
+# their state in a local disk cache
+background_callback_manager = DiskcacheManager(diskcache.Cache("./cache"))
+
 app = Dash(
     name="Market Monitor",
     external_stylesheets=[dbc.themes.BOOTSTRAP],
     suppress_callback_exceptions=True,
+    background_callback_manager=background_callback_manager,
 )
 
-# load dataset
-df = preprocess_stats("real_estate_stats_texas.csv")
+# load dataset (from the parquet snapshots if the csv files did not change).
+# a new data drop is picked up by the watcher and swapped in while running.
+# the stats come from STATS_FILE, a csv file or a stats store (snapshot.py)
+dataset = DatasetStore()
+dataset.watch()
 
-df_current_listings = preprocess_listings("real_estate_broker_data_texas.csv")
 
-df_own = df_current_listings[df_current_listings["brokered_by"] == 53016]
-df_own["date_sold"] = pd.to_datetime(df_own["date_sold"])
-df_recently_sold = (
-    df_own[df_own["status"] == "sold"][
-        [
-            "date_sold",
-            "street",
-            "city",
-            "zip_code",
-            "price",
-            "house_size",
-            "bed",
-            "bath",
-            "acre_lot",
-        ]
-    ]
-    .sort_values("date_sold", ascending=False)
-    .head(7)
-)
-df_recently_sold["date_sold"] = pd.to_datetime(df_own["date_sold"]).dt.date
-df_new_listings = (
-    df_own[df_own["status"] == "for_sale"][
-        [
-            "date_published",
-            "street",
-            "city",
-            "zip_code",
-            "price",
-            "house_size",
-            "bed",
-            "bath",
-            "acre_lot",
-        ]
-    ]
-    .sort_values("date_published", ascending=False)
-    .head(7)
-)
+# listings partitioned by broker, each broker's frames are built on first use
+def broker_view(data, broker):
+    return broker_index(data.listings).view(broker or DEFAULT_BROKER)
+
+
+# dashboard KPIs are recomputed in the background and read through a callback.
+# only the default broker's are built here; the refresh thread starts with the
+# first request, so it never runs in the gunicorn master (see serve.py)
+kpi_engine = KpiEngine(lambda broker: broker_view(dataset.current, broker).df_own)
+with startup.step("derived_frames"):
+    kpi_engine.prefetch([DEFAULT_BROKER])
 
 
-# create widgets
+@app.server.before_request
+def start_kpi_engine():
+    kpi_engine.start()
 
-zips = df.postal_code.unique()
+# create widgets, they keep their values while switching tabs
 
 median_price = dcc.RadioItems(
     options={
@@ -82,29 +76,21 @@ median_price = dcc.RadioItems(
     value="median_listing_price",
     id="median",
     inline=True,
+    persistence=True,
     style={"display": "flex", "flex-direction": "row", "gap": "20px"},
 )
-zip_select = dcc.Checklist(
-    options=zips,
-    value=["77546"],
-    id="zips",
-    inline=True,
-    style={"display": "flex", "flex-direction": "row", "gap": "10px"},
-)
-zip_select_listings = dcc.Checklist(
-    options=zips,
-    value=["77546"],
-    id="zips-listings",
-    inline=True,
-    style={"display": "flex", "flex-direction": "row", "gap": "10px"},
-)
-zip_select_current = dcc.Checklist(
-    options=zips,
-    value=["77546"],
-    id="zips-current",
-    inline=True,
-    style={"display": "flex", "flex-direction": "row", "gap": "10px"},
-)
+
+
+def zip_select(id, zips):
+    return dcc.Checklist(
+        options=zips,
+        value=["77546"],
+        id=id,
+        inline=True,
+        persistence=True,
+        style={"display": "flex", "flex-direction": "row", "gap": "10px"},
+    )
+
 
 listings = dcc.RadioItems(
     options={
@@ -115,12 +101,84 @@ listings = dcc.RadioItems(
     value="total_listing_count",
     id="listings",
     inline=True,
+    persistence=True,
     style={"display": "flex", "flex-direction": "row", "gap": "20px"},
 )
 
-price = 500000
-bed = 5
-bath = 5
+sales_window = dcc.RadioItems(
+    options={
+        "3M": "Last 3 months",
+        "12M": "Last 12 months",
+        "36M": "Last 3 years",
+        "12W": "Last 12 weeks",
+    },
+    value="3M",
+    id="sales-window",
+    inline=True,
+    persistence=True,
+    style={"display": "flex", "flex-direction": "row", "gap": "20px"},
+)
+
+histogram_options = html.Div(
+    [
+        "Bins",
+        dcc.RadioItems(
+            options=[6, 12, 24, 48],
+            value=12,
+            id="histogram-bins",
+            inline=True,
+            persistence=True,
+            style={"display": "flex", "flex-direction": "row", "gap": "10px"},
+        ),
+        dcc.Checklist(
+            options={"log": "Log price"},
+            value=[],
+            id="histogram-log",
+            inline=True,
+            persistence=True,
+        ),
+    ],
+    style={"display": "flex", "flex-direction": "row", "gap": "20px"},
+)
+
+
+# the broker is chosen per browser session
+def broker_select(data):
+    return dcc.Dropdown(
+        options=broker_index(data.listings).brokers(),
+        value=DEFAULT_BROKER,
+        id="broker",
+        clearable=False,
+        persistence=True,
+        persistence_type="session",
+        style={"width": "200px"},
+    )
+
+
+# serialised figures of the Price and Listings tabs, keyed on the chart, the
+# version of the stats frame they are drawn from and the callback inputs. an
+# upload merge keeps the stats frame and its figures, a reload drops them.
+# bounded by size (FIGURE_CACHE_MB)
+figure_cache = ByteLRUCache(
+    max_bytes=int(os.environ.get("FIGURE_CACHE_MB", 64)) * 1024 * 1024,
+    name="figure",
+)
+
+
+def drop_stale_figures(data):
+    version = frame_version(data.stats)
+    figure_cache.discard(lambda key: key[1] != version)
+
+
+dataset.on_swap = drop_stale_figures
+
+
+def cached_figure(key, build):
+    figure = figure_cache.get(key)
+    if figure is None:
+        figure = build().to_json()
+        figure_cache.put(key, figure)
+    return json.loads(figure)
 
 
 # app layout
@@ -138,409 +196,574 @@ sidebar = html.Div(
     style={"height": "100%"},
 )
 
-content = html.Div(
-    [
-        html.H1("Market Monitor", className="text-center fw-bold m-2"),
-        html.Br(),
-        dcc.Tabs(
-            [
-                # Dashboard tab
-                dcc.Tab(
-                    [
-                        html.Br(),
-                        html.Div(
-                            [
-                                # total sales this month
-                                html.Div(
-                                    [
-                                        html.H5(
-                                            "Total sales in "
-                                            + str(
-                                                datetime.datetime.now().strftime(
-                                                    "%m/%Y"
-                                                )
-                                            )
-                                        ),
-                                        dcc.Markdown(
-                                            f"**${total_sales(df_own):,.2f}**"
-                                        ),  # Display revenue with formatting
-                                    ],
-                                    style={
-                                        "flex": "1",
-                                        "align-self": "center",
-                                        "backgroundColor": "F2F2F2",
-                                        "fontSize": 24,
-                                        "text-align": "center",
-                                    },
-                                ),
-                                # dash data table recent sales
-                                html.Div(
-                                    [
-                                        html.H4("Recent sales"),
-                                        dash_table.DataTable(
-                                            data=df_recently_sold.to_dict("records"),
-                                            columns=[
-                                                {
-                                                    "name": i,
-                                                    "id": i,
-                                                    "type": (
-                                                        "numeric"
-                                                        if i == "price"
-                                                        else "text"
-                                                    ),
-                                                    "format": (
-                                                        Format(
-                                                            precision=2,
-                                                            scheme=Scheme.fixed,
-                                                            group=",",
-                                                            symbol=Symbol.yes,
-                                                            symbol_prefix="$",
-                                                        )
-                                                        if i == "price"
-                                                        else None
-                                                    ),
-                                                }
-                                                for i in df_recently_sold.columns
-                                            ],
-                                            style_table={
-                                                "width": "100%",
-                                                "marginRight": "20px",
-                                                "backgroundColor": "blue",
-                                            },
-                                        ),
-                                    ],
-                                    style={"flex": "2", "backgroundColor": "grey"},
-                                ),
-                            ],
-                            style={
-                                "display": "block",
-                                "flex-direction": "row",
-                                "align-items": "center",
-                            },
-                        ),
-                        html.Br(),
-                        # dash data table New Listings
-                        html.Div(
-                            [
-                                html.Div(
-                                    [
-                                        html.H4("New Listings"),
-                                        dash_table.DataTable(
-                                            data=df_new_listings.to_dict("records"),
-                                            columns=[
-                                                {
-                                                    "name": i,
-                                                    "id": i,
-                                                    "type": (
-                                                        "numeric"
-                                                        if i == "price"
-                                                        else "text"
-                                                    ),
-                                                    "format": (
-                                                        Format(
-                                                            precision=2,
-                                                            scheme=Scheme.fixed,
-                                                            group=",",
-                                                            symbol=Symbol.yes,
-                                                            symbol_prefix="$",
-                                                        )
-                                                        if i == "price"
-                                                        else None
-                                                    ),
-                                                }
-                                                for i in df_new_listings.columns
-                                            ],
-                                            style_table={
-                                                "width": "100%",
-                                                "marginRight": "20px",  # Add margin to the right
-                                                "backgroundColor": "#e98074",
-                                            },
+
+# the content of each tab is built when the tab is opened (see render_tab),
+# only the landing tab is part of the page layout
+
+
+# the text of the KPI cards, by component id
+def kpi_texts(kpis):
+    return {
+        "kpi-total-sales-title": "Total sales in " + kpis.month_label,
+        "kpi-total-sales": f"**${kpis.total_sales:,.2f}**",
+        "kpi-active-listings": f"**{kpis.active_listings}**",
+        "kpi-highest-closing-title": "Highest closing in " + kpis.year_label,
+        "kpi-highest-closing": f"$**{kpis.highest_closing:,.2f}**",
+        "kpi-sold-last-quarter": f"**{kpis.sold_last_quarter}**",
+        "kpi-median-price": f"$**{kpis.median_price:,.2f}**",
+    }
+
+
+kpi_ids = list(kpi_texts(kpi_engine.get(DEFAULT_BROKER)))
+
+
+def dashboard_tab():
+    # filled in with the current figures, the callback then switches them to
+    # the session's broker
+    kpis = kpi_texts(kpi_engine.get(DEFAULT_BROKER))
+    return html.Div(
+        [
+            # re-read the KPI snapshot every minute
+            dcc.Interval(id="kpi-interval", interval=60 * 1000),
+            html.Br(),
+            html.Div(
+                [
+                    # total sales this month
+                    html.Div(
+                        [
+                            html.H5(
+                                kpis["kpi-total-sales-title"],
+                                id="kpi-total-sales-title",
+                            ),
+                            dcc.Markdown(
+                                kpis["kpi-total-sales"], id="kpi-total-sales"
+                            ),  # Display revenue with formatting
+                        ],
+                        style={
+                            "flex": "1",
+                            "align-self": "center",
+                            "backgroundColor": "F2F2F2",
+                            "fontSize": 24,
+                            "text-align": "center",
+                        },
+                    ),
+                    # dash data table recent sales
+                    html.Div(
+                        [
+                            html.H4("Recent sales"),
+                            dash_table.DataTable(
+                                id="recent-sales",
+                                data=[],
+                                columns=[
+                                    {
+                                        "name": i,
+                                        "id": i,
+                                        "type": (
+                                            "numeric"
+                                            if i == "price"
+                                            else "text"
                                         ),
-                                    ],
-                                    style={
-                                        "display": "block",
-                                        "backgroundColor": "grey",
-                                        "width": "100%",
-                                    },
-                                ),
-                            ],
-                            className="box-shadow-container",
-                            style={
-                                "display": "block",
-                                "flex-direction": "row",
-                                "align-items": "center",
-                            },
-                        ),
-                        html.Br(),
-                        # sales value for last 3 months
-                        html.Div(
-                            [
-                                html.Br(),
-                                dcc.Graph(
-                                    id="sales", figure=create_sales_chart(df_own)
-                                ),
-                            ],
-                            style={
-                                "flex": "1",
-                                "align-self": "center",
-                                "fontSize": 24,
-                                "text-align": "center",
-                            },
-                        ),
-                        html.Div(
-                            [
-                                # display number of current / active listings
-                                html.Div(
-                                    [
-                                        html.H4("Active listings"),
-                                        dcc.Markdown(
-                                            f"**{current_number_of_listings(df_own)}**"
-                                        ),  # display revenue with formatting
-                                    ],
-                                    className="box-shadow-container",
-                                    style={
-                                        "flex": "1",
-                                        "align-self": "center",
-                                        "fontSize": 24,
-                                        "text-align": "center",
-                                        "margin": "20px",
-                                        "padding-top": "15px",
-                                    },
-                                ),
-                                # display highest closing sum for this year
-                                html.Div(
-                                    [
-                                        html.H4(
-                                            "Highest closing in "
-                                            + str(
-                                                datetime.datetime.now().strftime("%Y")
+                                        "format": (
+                                            Format(
+                                                precision=2,
+                                                scheme=Scheme.fixed,
+                                                group=",",
+                                                symbol=Symbol.yes,
+                                                symbol_prefix="$",
                                             )
+                                            if i == "price"
+                                            else None
                                         ),
-                                        dcc.Markdown(
-                                            f"$**{highest_closing(df_own):,.2f}**"
-                                        ),
-                                    ],
-                                    className="box-shadow-container",
-                                    style={
-                                        "flex": "1",
-                                        "align-self": "center",
-                                        "fontSize": 24,
-                                        "text-align": "center",
-                                        "margin": "20px",
-                                        "padding-top": "15px",
-                                    },
-                                ),
-                            ],
-                            style={
-                                "display": "flex",
-                                "flex-direction": "row",
-                                "align-items": "center",
-                            },
-                        ),
-                        html.Div(
-                            [
-                                # number of listings sold last 3 months
-                                html.Div(
-                                    [
-                                        html.H4("Sold last quarter"),
-                                        dcc.Markdown(f"**{sold_last_quarter(df_own)}**"),
-                                    ],
-                                    className="box-shadow-container",
-                                    style={
-                                        "flex": "1",
-                                        "align-self": "center",
-                                        "fontSize": 24,
-                                        "text-align": "center",
-                                        "margin": "20px",
-                                        "padding-top": "15px",
-                                    },
-                                ),
-                                # dispaly median listing price
-                                html.Div(
-                                    [
-                                        html.H4("Median price"),
-                                        dcc.Markdown(
-                                            f"$**{median_price_listings(df_own):,.2f}**"
-                                        ),
-                                    ],
-                                    className="box-shadow-container",
-                                    style={
-                                        "flex": "1",
-                                        "align-self": "center",
-                                        "fontSize": 24,
-                                        "text-align": "center",
-                                        "margin": "20px",
-                                        "padding-top": "15px",
-                                    },
-                                ),
-                            ],
-                            style={
-                                "display": "flex",
-                                "flex-direction": "row",
-                                "align-items": "center",
-                            },
-                        ),
-                        html.Div(
-                            [
-                                # display price distribution histogram
-                                dcc.Graph(
-                                    id="histogram",
-                                    figure=create_price_histogram(df_own, "price"),
-                                ),
-                                html.Br(),
-                                html.Br(),
-                                html.Br(),
-                                html.Br(),
-                            ]
-                        ),
-                    ],
-                    style={"display": "flex", "flex-direction": "column"},
-                    label="Dashboard",
-                ),
-                # Price tab
-                dcc.Tab(
-                    [
-                        html.Br(),
-                        "Median Price",
-                        median_price,
-                        "Zip code",
-                        zip_select,
-                        html.Br(),
-                        dcc.Graph(id="median-graph"),
-                    ],
-                    label="Price",
-                ),
-                # Listings tab
-                dcc.Tab(
-                    [
-                        html.Br(),
-                        "Listings",
-                        listings,
-                        "Zip code",
-                        zip_select_listings,
-                        html.Br(),
-                        dcc.Graph(id="listings-graph"),
-                    ],
-                    label="Listings",
-                ),
-                # Current listings tab
-                dcc.Tab(
-                    [
-                        html.Br(),
-                        html.Br(),
-                        html.Div(
-                            [
-                                html.Br(),
-                                html.H5("Price"),
-                                dcc.Slider(
-                                    0,
-                                    4000000,
-                                    marks={
-                                        100000: "100K",
-                                        300000: "300K",
-                                        500000: "500K",
-                                        1000000: "1M",
-                                        2000000: "2M",
-                                        4000000: "5M",
-                                    },
-                                    value=500000,
-                                    id="price",
-                                    tooltip={
-                                        "always_visible": True,
-                                        "template": "$ {value}",
-                                    },
-                                ),
-                                html.Br(),
-                                dbc.Row(
-                                    [
-                                        dbc.Col(
-                                            [
-                                                html.H5("Bedrooms"),
-                                                dcc.Slider(
-                                                    0, 5, 1, value=2, id="bedroom"
-                                                ),
-                                            ]
+                                    }
+                                    for i in ["date_sold"] + table_columns
+                                ],
+                                style_table={
+                                    "width": "100%",
+                                    "marginRight": "20px",
+                                    "backgroundColor": "blue",
+                                },
+                            ),
+                        ],
+                        style={"flex": "2", "backgroundColor": "grey"},
+                    ),
+                ],
+                style={
+                    "display": "block",
+                    "flex-direction": "row",
+                    "align-items": "center",
+                },
+            ),
+            html.Br(),
+            # dash data table New Listings
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.H4("New Listings"),
+                            dash_table.DataTable(
+                                id="new-listings",
+                                data=[],
+                                columns=[
+                                    {
+                                        "name": i,
+                                        "id": i,
+                                        "type": (
+                                            "numeric"
+                                            if i == "price"
+                                            else "text"
                                         ),
-                                        dbc.Col(
-                                            [
-                                                html.H5("Bathrooms"),
-                                                dcc.Slider(
-                                                    0, 4, 1, value=1, id="bathroom"
-                                                ),
-                                            ]
+                                        "format": (
+                                            Format(
+                                                precision=2,
+                                                scheme=Scheme.fixed,
+                                                group=",",
+                                                symbol=Symbol.yes,
+                                                symbol_prefix="$",
+                                            )
+                                            if i == "price"
+                                            else None
                                         ),
-                                    ]
-                                ),
-                                "Zip code",
-                                zip_select_current,
-                                html.Br(),
-                            ]
-                        ),
-                        html.Div(
-                            [
-                                dcc.Graph(id="current-listings-graph"),
-                                dcc.Location(id="url", refresh=True),
-                                html.Br(),
-                            ]
-                        ),
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    id="filtered-listings",
-                                    figure=create_filterd_listings_table(
-                                        df_own, price, bed, bath
+                                    }
+                                    for i in ["date_published"] + table_columns
+                                ],
+                                style_table={
+                                    "width": "100%",
+                                    "marginRight": "20px",  # Add margin to the right
+                                    "backgroundColor": "#e98074",
+                                },
+                            ),
+                        ],
+                        style={
+                            "display": "block",
+                            "backgroundColor": "grey",
+                            "width": "100%",
+                        },
+                    ),
+                ],
+                className="box-shadow-container",
+                style={
+                    "display": "block",
+                    "flex-direction": "row",
+                    "align-items": "center",
+                },
+            ),
+            html.Br(),
+            # sales value for the chosen window
+            html.Div(
+                [
+                    html.Br(),
+                    sales_window,
+                    dcc.Graph(id="sales"),
+                ],
+                style={
+                    "flex": "1",
+                    "align-self": "center",
+                    "fontSize": 24,
+                    "text-align": "center",
+                },
+            ),
+            html.Div(
+                [
+                    # display number of current / active listings
+                    html.Div(
+                        [
+                            html.H4("Active listings"),
+                            dcc.Markdown(
+                                kpis["kpi-active-listings"], id="kpi-active-listings"
+                            ),  # display revenue with formatting
+                        ],
+                        className="box-shadow-container",
+                        style={
+                            "flex": "1",
+                            "align-self": "center",
+                            "fontSize": 24,
+                            "text-align": "center",
+                            "margin": "20px",
+                            "padding-top": "15px",
+                        },
+                    ),
+                    # display highest closing sum for this year
+                    html.Div(
+                        [
+                            html.H4(
+                                kpis["kpi-highest-closing-title"],
+                                id="kpi-highest-closing-title",
+                            ),
+                            dcc.Markdown(
+                                kpis["kpi-highest-closing"], id="kpi-highest-closing"
+                            ),
+                        ],
+                        className="box-shadow-container",
+                        style={
+                            "flex": "1",
+                            "align-self": "center",
+                            "fontSize": 24,
+                            "text-align": "center",
+                            "margin": "20px",
+                            "padding-top": "15px",
+                        },
+                    ),
+                ],
+                style={
+                    "display": "flex",
+                    "flex-direction": "row",
+                    "align-items": "center",
+                },
+            ),
+            html.Div(
+                [
+                    # number of listings sold last 3 months
+                    html.Div(
+                        [
+                            html.H4("Sold last quarter"),
+                            dcc.Markdown(
+                                kpis["kpi-sold-last-quarter"],
+                                id="kpi-sold-last-quarter",
+                            ),
+                        ],
+                        className="box-shadow-container",
+                        style={
+                            "flex": "1",
+                            "align-self": "center",
+                            "fontSize": 24,
+                            "text-align": "center",
+                            "margin": "20px",
+                            "padding-top": "15px",
+                        },
+                    ),
+                    # dispaly median listing price
+                    html.Div(
+                        [
+                            html.H4("Median price"),
+                            dcc.Markdown(
+                                kpis["kpi-median-price"], id="kpi-median-price"
+                            ),
+                        ],
+                        className="box-shadow-container",
+                        style={
+                            "flex": "1",
+                            "align-self": "center",
+                            "fontSize": 24,
+                            "text-align": "center",
+                            "margin": "20px",
+                            "padding-top": "15px",
+                        },
+                    ),
+                ],
+                style={
+                    "display": "flex",
+                    "flex-direction": "row",
+                    "align-items": "center",
+                },
+            ),
+            html.Div(
+                [
+                    # display price distribution histogram
+                    histogram_options,
+                    dcc.Graph(id="histogram"),
+                    html.Br(),
+                    html.Br(),
+                    html.Br(),
+                    html.Br(),
+                ]
+            ),
+        ],
+        style={"display": "flex", "flex-direction": "column"},
+    )
+
+
+def price_tab():
+    return html.Div(
+        [
+            html.Br(),
+            "Median Price",
+            median_price,
+            "Zip code",
+            zip_select("zips", dataset.current.zips),
+            html.Br(),
+            dcc.Graph(id="median-graph"),
+        ]
+    )
+
+
+def listings_tab():
+    return html.Div(
+        [
+            html.Br(),
+            "Listings",
+            listings,
+            "Zip code",
+            zip_select("zips-listings", dataset.current.zips),
+            html.Br(),
+            dcc.Graph(id="listings-graph"),
+        ]
+    )
+
+
+def current_listings_tab():
+    return html.Div(
+        [
+            html.Br(),
+            html.Br(),
+            html.Div(
+                [
+                    html.Br(),
+                    html.H5("Price"),
+                    dcc.Slider(
+                        0,
+                        4000000,
+                        marks={
+                            100000: "100K",
+                            300000: "300K",
+                            500000: "500K",
+                            1000000: "1M",
+                            2000000: "2M",
+                            4000000: "5M",
+                        },
+                        value=500000,
+                        id="price",
+                        persistence=True,
+                        tooltip={
+                            "always_visible": True,
+                            "template": "$ {value}",
+                        },
+                    ),
+                    html.Br(),
+                    dbc.Row(
+                        [
+                            dbc.Col(
+                                [
+                                    html.H5("Bedrooms"),
+                                    dcc.Slider(
+                                        0,
+                                        5,
+                                        1,
+                                        value=2,
+                                        id="bedroom",
+                                        persistence=True,
                                     ),
-                                ),
-                                html.Br(),
-                            ]
-                        ),
-                    ],
-                    label="Current Listings",
-                ),
-                # Upload tab
-                dcc.Tab(
-                    [
-                        html.Br(),
-                        "Upload",
-                        html.Br(),
-                        dcc.Upload(
-                            id="upload-data",
-                            children=html.Div(
-                                ["Drag and Drop or ", html.A("Select Files")]
+                                ]
+                            ),
+                            dbc.Col(
+                                [
+                                    html.H5("Bathrooms"),
+                                    dcc.Slider(
+                                        0,
+                                        4,
+                                        1,
+                                        value=1,
+                                        id="bathroom",
+                                        persistence=True,
+                                    ),
+                                ]
                             ),
-                            style={
-                                "width": "100%",
-                                "height": "60px",
-                                "lineHeight": "60px",
-                                "borderWidth": "1px",
-                                "borderStyle": "dashed",
-                                "borderRadius": "5px",
-                                "textAlign": "center",
-                                "margin": "10px",
-                            },
-                            # Not allow multiple files to be uploaded
-                            multiple=True,
-                        ),
-                        dcc.Store(id="store"),
-                        html.Div(id="output-data-upload"),
-                    ],
-                    label="Upload",
+                        ]
+                    ),
+                    "Zip code",
+                    zip_select("zips-current", dataset.current.zips),
+                    html.Br(),
+                ]
+            ),
+            html.Div(
+                [
+                    dcc.Graph(id="current-listings-graph"),
+                    dcc.Location(id="url", refresh=True),
+                    html.Br(),
+                ]
+            ),
+            html.Div(
+                [
+                    # paged, sorted and filtered on the server
+                    create_table("filtered-listings"),
+                    html.Br(),
+                ]
+            ),
+        ]
+    )
+
+
+def upload_tab():
+    return html.Div(
+        [
+            html.Br(),
+            "Upload",
+            html.Br(),
+            dcc.Upload(
+                id="upload-data",
+                children=html.Div(
+                    ["Drag and Drop or ", html.A("Select Files")]
                 ),
-            ]
+                style={
+                    "width": "100%",
+                    "height": "60px",
+                    "lineHeight": "60px",
+                    "borderWidth": "1px",
+                    "borderStyle": "dashed",
+                    "borderRadius": "5px",
+                    "textAlign": "center",
+                    "margin": "10px",
+                },
+                # Not allow multiple files to be uploaded
+                multiple=True,
+                # rejected in the browser, before the upload
+                max_size=MAX_UPLOAD_BYTES,
+            ),
+            # add the uploaded listings to the live dataset
+            html.Button(
+                "Add to dataset",
+                id="ingest-button",
+                className="btn btn-primary m-2",
+            ),
+            html.Progress(id="ingest-progress", value="0", max="1"),
+            html.Div(id="output-data-upload"),
+        ]
+    )
+
+
+tab_builders = {
+    "dashboard": dashboard_tab,
+    "price": price_tab,
+    "listings": listings_tab,
+    "current-listings": current_listings_tab,
+    "upload": upload_tab,
+}
+
+# serialised size of every rendered tab and of the page layout, served at
+# /payloads. callbacks run in threads, so the counters are updated under a lock
+payloads = {}
+payloads_lock = threading.Lock()
+
+
+def record_payload(name, component):
+    size = len(to_json(component))
+    with payloads_lock:
+        entry = payloads.setdefault(
+            name, {"renders": 0, "bytes": 0, "total_bytes": 0}
+        )
+        entry["renders"] += 1
+        entry["bytes"] = size
+        entry["total_bytes"] += size
+    return component
+
+
+def render_tab(tab):
+    return record_payload(tab, tab_builders[tab]())
+
+
+# a function, so every page load gets the current dataset and KPIs
+def serve_layout():
+    data = dataset.current
+    content = html.Div(
+        [
+            html.H1("Market Monitor", className="text-center fw-bold m-2"),
+            html.Div(["Broker", broker_select(data)], className="d-flex gap-2"),
+            html.Br(),
+            dcc.Tabs(
+                [
+                    dcc.Tab(label="Dashboard", value="dashboard"),
+                    dcc.Tab(label="Price", value="price"),
+                    dcc.Tab(label="Listings", value="listings"),
+                    dcc.Tab(label="Current Listings", value="current-listings"),
+                    dcc.Tab(label="Upload", value="upload"),
+                ],
+                id="tabs",
+                value="dashboard",
+            ),
+            html.Div(render_tab("dashboard"), id="tab-content"),
+            # outside of the tabs, so an ingest finishes on any tab
+            html.Div(id="ingest-status"),
+            dcc.Store(id="store"),
+        ],
+        className="col-9 mx-auto",
+        style={"height": "100vh"},
+    )
+    return record_payload(
+        "layout",
+        html.Div(
+            [html.Div([sidebar, content], className="row")],
+            className="container-fluid",
+            style={"height": "100%", "column-count": 2},
         ),
+    )
+
+
+app.layout = serve_layout
+
+
+@app.server.route("/payloads")
+def payload_stats():
+    # a copy, the live counters change while flask serialises the response
+    with payloads_lock:
+        return {name: dict(entry) for name, entry in payloads.items()}
+
+
+# latency, response size, errors and cache hits of every callback at /metrics
+metrics.install(
+    app,
+    caches=[figure_cache, filter_cache, trendline_cache, closed_sales_cache],
+    gauges={"market_monitor_dataset_version": lambda: dataset.version},
+)
+
+
+# callbacks
+
+
+@callback(
+    Output("tab-content", "children"),
+    Input("tabs", "value"),
+    prevent_initial_call=True,
+)
+def update_tab(tab):
+    return render_tab(tab)
+
+
+@callback(
+    [Output(id, "children") for id in kpi_ids],
+    [Input("kpi-interval", "n_intervals"), Input("broker", "value")],
+)
+def update_kpis(n_intervals, broker):
+    texts = kpi_texts(kpi_engine.get(broker or DEFAULT_BROKER))
+    return [texts[id] for id in kpi_ids]
+
+
+@callback(
+    [Output("recent-sales", "data"), Output("new-listings", "data")],
+    [
+        Input("kpi-interval", "n_intervals"),
+        Input("ingest-status", "children"),
+        Input("broker", "value"),
     ],
-    className="col-9 mx-auto",
-    style={"height": "100vh"},
 )
+def update_recent_tables(n_intervals, ingest_status, broker):
+    view = broker_view(dataset.current, broker)
+    return to_records(view.recently_sold), to_records(view.new_listings)
 
 
-app.layout = html.Div(
-    [html.Div([sidebar, content], className="row")],
-    className="container-fluid",
-    style={"height": "100%", "column-count": 2},
+@callback(
+    Output("sales", "figure"),
+    [
+        Input("sales-window", "value"),
+        Input("kpi-interval", "n_intervals"),
+        Input("broker", "value"),
+    ],
 )
+def update_sales_chart(window, n_intervals, broker):
+    # e.g. "36M" -> 36 months, "12W" -> 12 weeks
+    df_own = broker_view(dataset.current, broker).df_own
+    return create_sales_chart(df_own, int(window[:-1]), window[-1])
 
-# callbacks
+
+@callback(
+    Output("histogram", "figure"),
+    [
+        Input("histogram-bins", "value"),
+        Input("histogram-log", "value"),
+        Input("broker", "value"),
+    ],
+)
+def update_price_histogram(nbins, log, broker):
+    df_own = broker_view(dataset.current, broker).df_own
+    return create_price_histogram(df_own, "price", nbins, "log" in log)
 
 
 @callback(
@@ -548,7 +771,12 @@ app.layout = html.Div(
     [Input("median", "value"), Input("zips", "value")],
 )
 def update_median_price_chart(median, zip):
-    return create_median_price_chart(df, median, zip)
+    data = dataset.current
+    key = ("median", frame_version(data.stats), median, tuple(sorted(zip)))
+    figure = cached_figure(
+        key, lambda: create_median_price_chart(data.stats, median, zip)[0]
+    )
+    return figure, zip
 
 
 @callback(
@@ -556,7 +784,11 @@ def update_median_price_chart(median, zip):
     [Input("listings", "value"), Input("zips-listings", "value")],
 )
 def update_listings_chart(listings, zip):
-    return create_listings_chart(df, listings, zip)
+    data = dataset.current
+    key = ("listings", frame_version(data.stats), listings, tuple(sorted(zip)))
+    return cached_figure(
+        key, lambda: create_listings_chart(data.stats, listings, zip)
+    )
 
 
 @callback(
@@ -566,23 +798,46 @@ def update_listings_chart(listings, zip):
         Input("bedroom", "value"),
         Input("bathroom", "value"),
         Input("zips-current", "value"),
+        Input("broker", "value"),
     ],
 )
-def update_current_listings_chart(price, bed, bath, zip):
+def update_current_listings_chart(price, bed, bath, zip, broker):
+    df_own = broker_view(dataset.current, broker).df_own
     return create_current_listings_chart(df_own, price, bed, bath, zip)
 
 
 @callback(
-    Output("filtered-listings", "figure"),
+    [
+        Output("filtered-listings", "data"),
+        Output("filtered-listings", "page_count"),
+        Output("filtered-listings", "page_current"),
+    ],
     [
         Input("price", "value"),
         Input("bedroom", "value"),
         Input("bathroom", "value"),
         Input("zips-current", "value"),
+        Input("filtered-listings", "page_current"),
+        Input("filtered-listings", "page_size"),
+        Input("filtered-listings", "sort_by"),
+        Input("filtered-listings", "filter_query"),
+        Input("broker", "value"),
     ],
 )
-def update_filterd_listings_table(price, bed, bath, zip):
-    return create_filterd_listings_table(df_own, price, bed, bath, zip)
+def update_filterd_listings_table(
+    price, bed, bath, zip, page_current, page_size, sort_by, filter_query, broker
+):
+    return create_filterd_listings_table(
+        broker_view(dataset.current, broker).df_own,
+        price,
+        bed,
+        bath,
+        zip,
+        page_current,
+        page_size,
+        sort_by,
+        filter_query,
+    )
 
 
 @callback(
@@ -593,13 +848,52 @@ def update_filterd_listings_table(price, bed, bath, zip):
 )
 def update_output(list_of_contents, list_of_names, list_of_dates):
     if list_of_contents is not None:
-        children = [
-            parse_contents(c, n, d)
-            for c, n, d in zip(list_of_contents, list_of_names, list_of_dates)
-        ]
+        # the files are parsed in parallel on the upload thread pool
+        children = map_uploads(
+            parse_contents, list_of_contents, list_of_names, list_of_dates
+        )
         return children
 
 
+# parse, validate and preprocess the uploaded files in a background process;
+# the prepared rows are staged on disk and handed over through the store
+@callback(
+    Output("store", "data"),
+    Input("ingest-button", "n_clicks"),
+    State("upload-data", "contents"),
+    State("upload-data", "filename"),
+    background=True,
+    running=[(Output("ingest-button", "disabled"), True, False)],
+    progress=[Output("ingest-progress", "value"), Output("ingest-progress", "max")],
+    prevent_initial_call=True,
+)
+def ingest_uploads(set_progress, n_clicks, list_of_contents, list_of_names):
+    if not list_of_contents:
+        raise PreventUpdate
+    return stage_uploads(list_of_contents, list_of_names, set_progress)
+
+
+# append the staged rows to the live dataset, as a new dataset version. the
+# frame is replaced, not modified, so the broker partitions, listing indexes,
+# filter cache and sales rollups rebuild for the new frame and the KPI engine
+# recomputes
+@callback(
+    Output("ingest-status", "children"),
+    Input("store", "data"),
+    prevent_initial_call=True,
+)
+def merge_uploads(data):
+    messages = list(data["errors"])
+    if data["staged"]:
+        dataset.merge(data["staged"])
+        kpi_engine.invalidate()
+        messages += [
+            f"{item['file']}: added {item['rows']:,} listings"
+            for item in data["staged"]
+        ]
+    return [html.Div(m) for m in messages]
+
+
 # @app.callback(Output("download", "data"), [Input("btn", "n_clicks")])
 # def func(n_clicks):
 #     return send_file("/home/emher/Documents/Untitled.png")
@@ -615,4 +909,11 @@ def redirect_to_url(clickData):
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    if startup.PROFILE:
+        with startup.step("layout"):
+            serve_layout()
+        startup.ready()
+        dataset.current.warming.join()
+        startup.write_profile()
+    else:
+        app.run(debug=True)
@@ -0,0 +1,218 @@
+# import libraries
+import argparse
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import pandas as pd
+
+import create_charts
+import listings_frame
+import listings_index
+import stats_matrix
+import trendlines
+from brokers import DEFAULT_BROKER, BrokerIndex, broker_index
+from kpi import compute_kpis
+from stats_store import build_stats_store
+from preprocess import included_postal_codes, preprocess_listings, preprocess_stats
+from synthetic import SEED, size_rows, write_listings, write_stats
+
+# micro-benchmarks of create_charts.py and preprocess.py on synthetic data
+# (see synthetic.py). every function is timed with cold caches, and its peak
+# memory (python and numpy allocations) is measured in one extra run.
+#
+#   python benchmark.py --sizes 10k 1m --output benchmark.json
+#   python benchmark.py --sizes 10k 1m --baseline benchmark_baseline.json
+#
+# with --baseline the results are compared to an earlier run and the exit
+# code is 1 if anything got slower by more than --tolerance
+
+DATA_DIR = "bench_data"
+# the synthetic data ends on the day of the run. the charts and KPIs measure
+# from pd.Timestamp.now(), so data relative to a fixed day would leave their
+# windows (this month, last quarter) a little emptier every day
+# differences below this are noise, whatever the ratio
+MIN_SECONDS = 0.005
+
+zips = [str(z) for z in included_postal_codes[:3]]
+
+
+def data_files(size, seed=SEED, data_dir=DATA_DIR):
+    today = pd.Timestamp.now().normalize()
+    out = os.path.join(data_dir, f"{size}-{seed}-{today:%Y-%m-%d}")
+    listings_file = os.path.join(out, "real_estate_broker_data_texas.csv")
+    stats_file = os.path.join(out, "real_estate_stats_texas.csv")
+    if not (os.path.exists(listings_file) and os.path.exists(stats_file)):
+        os.makedirs(out, exist_ok=True)
+        print(f"writing {size} rows of synthetic data to {out}")
+        write_listings(listings_file, size_rows(size), seed, today)
+        write_stats(stats_file, size_rows(size), seed, today)
+    # the same stats as a stats store
+    stats_store = os.path.join(out, "stats_store")
+    if not os.path.exists(stats_store):
+        build_stats_store(stats_file, stats_store)
+    return listings_file, stats_file, stats_store
+
+
+def clear_caches():
+    listings_index.filter_cache.clear()
+    listings_index._index_cache.clear()
+    trendlines.trendline_cache.clear()
+    stats_matrix.matrix_cache.clear()
+    listings_frame.closed_sales_cache.clear()
+    gc.collect()
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    clear_caches()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": min(timings),
+        "median_seconds": sorted(timings)[len(timings) // 2],
+        "peak_mb": peak / 1024**2,
+    }
+
+
+# name -> function of the loaded frames, for every benchmarked function
+def benchmarks(listings_file, stats_file, stats_store):
+    df_listings = preprocess_listings(listings_file, included_postal_codes)
+    df_stats = preprocess_stats(stats_file, included_postal_codes)
+    df_own = broker_index(df_listings).view(DEFAULT_BROKER).df_own
+    return {
+        "preprocess_listings": lambda: preprocess_listings(
+            listings_file, included_postal_codes
+        ),
+        "preprocess_stats": lambda: preprocess_stats(stats_file, included_postal_codes),
+        "preprocess_stats_store": lambda: preprocess_stats(
+            stats_store, included_postal_codes
+        ),
+        "total_sales": lambda: create_charts.total_sales(df_own),
+        "get_sales_last_n_months": lambda: create_charts.get_sales_last_n_months(
+            df_own, "date_sold", 36
+        ),
+        "create_sales_chart": lambda: create_charts.create_sales_chart(df_own, 12),
+        "current_number_of_listings": lambda: create_charts.current_number_of_listings(
+            df_own
+        ),
+        "highest_closing": lambda: create_charts.highest_closing(df_own),
+        "sold_last_quarter": lambda: create_charts.sold_last_quarter(df_own),
+        "median_price_listings": lambda: create_charts.median_price_listings(df_own),
+        "compute_kpis": lambda: compute_kpis(df_own),
+        "create_price_histogram": lambda: create_charts.create_price_histogram(
+            df_own, "price"
+        ),
+        "create_median_price_chart": lambda: create_charts.create_median_price_chart(
+            df_stats, "median_listing_price", zips
+        ),
+        "create_listings_chart": lambda: create_charts.create_listings_chart(
+            df_stats, "total_listing_count", zips
+        ),
+        "create_current_listings_chart": (
+            lambda: create_charts.create_current_listings_chart(
+                df_listings, 4_000_000, 1, 1, zips
+            )
+        ),
+        "create_filterd_listings_table": (
+            lambda: create_charts.create_filterd_listings_table(
+                df_listings,
+                4_000_000,
+                1,
+                1,
+                zips,
+                sort_by=[{"column_id": "price", "direction": "asc"}],
+            )
+        ),
+        "BrokerIndex": lambda: BrokerIndex(df_listings).view(DEFAULT_BROKER),
+    }
+
+
+def run(sizes, repeat=3, seed=SEED, only=None):
+    results = {}
+    for size in sizes:
+        results[size] = {}
+        for name, func in benchmarks(*data_files(size, seed)).items():
+            if only and name not in only:
+                continue
+            # the preprocess runs of the largest files take a while, once is enough
+            n = 1 if name.startswith("preprocess") and size_rows(size) > 1e6 else repeat
+            results[size][name] = measure(func, n)
+            r = results[size][name]
+            print(
+                f"{size:>4} {name:<30} {r['seconds'] * 1000:10.2f} ms "
+                f"{r['peak_mb']:9.1f} MB"
+            )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "seed": seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+# functions that got slower than the baseline by more than `tolerance`
+def compare(report, baseline, tolerance=0.25):
+    regressions = []
+    for size, results in report["results"].items():
+        for name, result in results.items():
+            old = baseline["results"].get(size, {}).get(name)
+            if old is None:
+                continue
+            ratio = result["seconds"] / max(old["seconds"], 1e-9)
+            slower = result["seconds"] - old["seconds"] > MIN_SECONDS
+            print(
+                f"{size:>4} {name:<30} {old['seconds'] * 1000:10.2f} -> "
+                f"{result['seconds'] * 1000:10.2f} ms ({ratio:5.2f}x)"
+                + ("  REGRESSION" if slower and ratio > 1 + tolerance else "")
+            )
+            if slower and ratio > 1 + tolerance:
+                regressions.append((size, name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark charts and preprocess.")
+    parser.add_argument("--sizes", nargs="+", default=["10k", "1m"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--only", nargs="+", help="benchmark only these functions")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="compare to the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run(args.sizes, args.repeat, args.seed, args.only)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
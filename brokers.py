@@ -0,0 +1,90 @@
+# import libraries
+from functools import cached_property
+
+from cache import LRUCache, frame_version
+from listings_frame import as_broker_listings, as_listings
+
+# listings partitioned by brokerage. the frame is split once into row
+# positions per brokered_by; a broker's listings, recent sales and new
+# listings are only built when that broker is first shown, then cached
+
+DEFAULT_BROKER = 53016
+
+table_columns = [
+    "street",
+    "city",
+    "zip_code",
+    "price",
+    "house_size",
+    "bed",
+    "bath",
+    "acre_lot",
+]
+
+
+# the 7 latest sales of a broker
+def recent_sales(df_own, n=7):
+    df_recently_sold = as_broker_listings(df_own).latest(
+        "sold", "date_sold", table_columns, n
+    )
+    df_recently_sold["date_sold"] = df_recently_sold["date_sold"].dt.date
+    return df_recently_sold
+
+
+# the 7 latest listings of a broker that are still for sale
+def new_listings(df_own, n=7):
+    df_new_listings = as_broker_listings(df_own).latest(
+        "for_sale", "date_published", table_columns, n
+    )
+    df_new_listings["date_published"] = df_new_listings["date_published"].dt.date
+    return df_new_listings
+
+
+# everything the dashboard shows for one broker, built on first use
+class BrokerView:
+    def __init__(self, broker, df_own):
+        self.broker = broker
+        self.df_own = df_own
+
+    @cached_property
+    def recently_sold(self):
+        return recent_sales(self.df_own)
+
+    @cached_property
+    def new_listings(self):
+        return new_listings(self.df_own)
+
+
+# a broker's df_own (a frame in memory, a BrokerListings in a ListingsDB) and
+# views are built on first use; the broker ids with their number of listings
+# come from the listings once
+class BrokerIndex:
+    def __init__(self, df, max_views=512):
+        self.listings = as_listings(df)
+        self._views = LRUCache(maxsize=max_views, name="broker_views")
+
+    @cached_property
+    def counts(self):
+        return self.listings.broker_counts()
+
+    # broker ids, the ones with the most listings first
+    def brokers(self):
+        return list(self.counts)
+
+    def view(self, broker):
+        broker = int(broker)
+        return self._views.get_or_compute(
+            broker,
+            lambda: BrokerView(
+                broker, self.listings.broker(broker, self.counts.get(broker, 0))
+            ),
+        )
+
+
+# one index per listings frame, rebuilt when the frame is replaced. the index
+# holds its frame, so only the latest couple of frames are kept
+_broker_indexes = LRUCache(maxsize=2, name="broker_index")
+
+
+def broker_index(df):
+    return _broker_indexes.get_or_compute(frame_version(df), lambda: BrokerIndex(df))
@@ -0,0 +1,143 @@
+# import libraries
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+
+# small thread-safe LRU cache shared by the callbacks (dash serves callbacks
+# from several threads), with hit / miss counters
+
+_missing = object()
+
+# called as on_lookup(cache, hit) on every get, set by metrics.py to count
+# hits and misses per callback
+on_lookup = None
+
+
+class LRUCache:
+    def __init__(self, maxsize=128, name=None):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is not _missing:
+                self._data.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if on_lookup is not None:
+            on_lookup(self, value is not _missing)
+        return default if value is _missing else value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    # return the cached value or compute, store and return it
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # drop the entries whose key matches, e.g. those of a replaced dataset
+    def discard(self, match):
+        with self._lock:
+            for key in [key for key in self._data if match(key)]:
+                self._pop(key)
+
+    def _pop(self, key):
+        del self._data[key]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+# LRU cache of serialised values (str / bytes) bounded by their total size in
+# bytes (str values counted as utf-8) instead of the number of entries
+class ByteLRUCache(LRUCache):
+    def __init__(self, max_bytes=64 * 1024 * 1024, name=None):
+        super().__init__(maxsize=None, name=name)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizes = {}
+
+    def put(self, key, value):
+        size = len(value.encode() if isinstance(value, str) else value)
+        # a value larger than the whole budget would only flush the cache
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.bytes -= self._sizes.pop(key)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                evicted, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def _pop(self, key):
+        del self._data[key]
+        self.bytes -= self._sizes.pop(key)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(bytes=self.bytes, max_bytes=self.max_bytes)
+        return stats
+
+
+# a version number per DataFrame object, so caches can key on "this data"
+# without hashing it. a replaced frame gets a new number; entries of frames
+# that were garbage collected are dropped
+_frame_versions = {}
+_next_frame_version = itertools.count(1)
+# reentrant: the weakref callback can run from a gc inside the locked block
+_frame_versions_lock = threading.RLock()
+
+
+def frame_version(df):
+    key = id(df)
+    with _frame_versions_lock:
+        entry = _frame_versions.get(key)
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+
+        def forget(ref, key=key):
+            with _frame_versions_lock:
+                if _frame_versions.get(key, (None,))[0] is ref:
+                    del _frame_versions[key]
+
+        version = next(_next_frame_version)
+        _frame_versions[key] = (weakref.ref(df, forget), version)
+        return version
@@ -1,38 +1,55 @@
 # import libraries
 from dash import dcc, html, Dash, dash_table, callback, Input, Output, State, no_update
 
-import plotly.express as px
-import plotly.graph_objects as go
 import pandas as pd
-import dash_bootstrap_components as dbc
+import numpy as np
 import datetime
-import base64
-import io
+import time
 
-# create charts and tables
+from dash.dash_table.Format import Format, Symbol, Scheme
+
+from listings_frame import as_broker_listings, sort_order
+from schema import listing_table_columns, numeric_table_columns, to_records
+from stats_matrix import stats_matrix
+from trendlines import trendline
+from upload import PREVIEW_ROWS, UploadError, parse_upload, upload_size
+
+# create charts and tables. plotly express and graph objects take a while to
+# import, so they are imported by the functions that draw, at first use
+
+# Current Listings scatter: WebGL above this many points, grid decimation
+# above MAX_SCATTER_POINTS
+WEBGL_THRESHOLD = 2000
+MAX_SCATTER_POINTS = 20000
 
 
 # table 1 dashboard
 # display total sales in this month
 def total_sales(df_own):
+    # date_sold is a datetime64 column (see schema.py), so these are
+    # vectorized datetime comparisons
+    now = pd.Timestamp.now()
+    first_day_current_month = now.normalize().replace(day=1)
     df_filtered = df_own[
-        (df_own["date_sold"] > str(pd.Timestamp.now().replace(day=1)))
-        & (df_own["date_sold"] < str(pd.Timestamp.now()))
+        (df_own["date_sold"] >= first_day_current_month)
+        & (df_own["date_sold"] <= now)
         & (df_own["status"] == "sold")
     ]
 
     return df_filtered["price"].astype(float).sum()
 
 
-# previous 3 months sales chart (bar)
-def create_sales_chart(df_own):
-    # Get the revenue data for the last 3 months
-    sales = get_sales_last_n_months(df_own, "date_sold")
+# sales chart for the last n months or weeks (bar)
+def create_sales_chart(df_own, periods=3, freq="M"):
+    import plotly.express as px
+
+    # Get the revenue data for the chosen window
+    sales = get_sales_last_n_months(df_own, "date_sold", periods, freq)
 
     # Create the bar chart using Plotly Express
     fig = px.bar(
         sales,
-        x="month",
+        x="period",
         y="sales",
         title="Monthly Revenue",
         # labels={'date_sold': 'Month', 'price': 'Revenue'},
@@ -44,59 +61,33 @@ def create_sales_chart(df_own):
             type='category',
             tickformat='%b-%Y'  # Format the tick labels to show month and year only
         ),
-        xaxis_title='Month',
+        xaxis_title="Week" if freq == "W" else "Month",
         yaxis_title='Values',
-        title='Monthly Sales Value'
+        title="Weekly Sales Value" if freq == "W" else "Monthly Sales Value",
     )
     return fig
 
 
-def get_sales_last_n_months(df, date_column):
-    # get the current date
+# sales value for the last n months (freq="M") or weeks (freq="W"), the
+# current period included up to now
+def get_sales_last_n_months(df, date_column, n=3, freq="M"):
     now = pd.Timestamp.now()
+    current = now.to_period(freq)
+    first = current - (n - 1)
+    window = pd.period_range(first, current, freq=freq)
 
-    # calculate the first day of the current month
-    first_day_current_month = now.replace(day=1)
-
-    # calculate the first day of the month 1 and 2 months before
-    first_day_1_months_ago = (
-        first_day_current_month - pd.DateOffset(months=1)
-    ).replace(day=1)
-    first_day_2_months_ago = (
-        first_day_current_month - pd.DateOffset(months=2)
-    ).replace(day=1)
-
-    # sum the sales value for each of the 3 previous months
-
-    this_month_sales = df.loc[
-        (df[date_column] >= first_day_current_month) & (df[date_column] <= now)
-    ]["price"].sum()
-    prev_month_sales = df.loc[
-        (df[date_column] >= first_day_1_months_ago)
-        & (df[date_column] < first_day_current_month)
-    ]["price"].sum()
-    prev2_month_sales = df.loc[
-        (df[date_column] >= first_day_2_months_ago)
-        & (df[date_column] < first_day_1_months_ago)
-    ]["price"].sum()
+    # the finished periods of the window and the current one up to now
+    listings = as_broker_listings(df)
+    sales = listings.period_sales(date_column, freq, first.start_time, now)
+    sales = sales.reindex(window, fill_value=0.0)
 
+    label = "%Y-%m-%d" if freq == "W" else "%Y-%m"
     return pd.DataFrame(
-        [
-            {
-                "month": str(first_day_2_months_ago.year)
-                + "-"
-                + str(first_day_2_months_ago.month),
-                "sales": prev2_month_sales,
-            },
-            {
-                "month": str(first_day_1_months_ago.year)
-                + "-"
-                + str(first_day_1_months_ago.month),
-                "sales": prev_month_sales,
-            },
-            {"month": str(now.year) + "-" + str(now.month), "sales": this_month_sales},
-        ],
-        index=[1, 2, 3],
+        {
+            "period": [p.start_time.strftime(label) for p in window],
+            "sales": sales.to_numpy(),
+        },
+        index=range(1, n + 1),
     )
 
 
@@ -107,19 +98,40 @@ def current_number_of_listings(df_own):
     return number_of_listings
 
 
-def create_table(df_current_listings):
-    fig = go.Figure(
-        data=[
-            go.Table(
-                header=dict(values=df_current_listings.columns[2:8], align="left"),
-                cells=dict(values=df_current_listings.values.T[2:8], align="left"),
-            )
-        ]
-    )
-    fig.update_layout(
-        paper_bgcolor="white", margin={"t": 0, "l": 0, "r": 0, "b": 0}, height=700
+# listings table with server-side paging, sorting and filtering: only the
+# rows of the visible page are sent, see create_filterd_listings_table
+def create_table(table_id, columns=listing_table_columns, page_size=20):
+    return dash_table.DataTable(
+        id=table_id,
+        columns=[
+            {
+                "name": i,
+                "id": i,
+                "type": "numeric" if i in numeric_table_columns else "text",
+                "format": (
+                    Format(
+                        precision=2,
+                        scheme=Scheme.fixed,
+                        group=",",
+                        symbol=Symbol.yes,
+                        symbol_prefix="$",
+                    )
+                    if i == "price"
+                    else None
+                ),
+            }
+            for i in columns
+        ],
+        page_current=0,
+        page_size=page_size,
+        page_action="custom",
+        sort_action="custom",
+        sort_mode="single",
+        sort_by=[],
+        filter_action="custom",
+        filter_query="",
+        style_table={"overflowX": "auto"},
     )
-    return fig
 
 
 # return highest closing sum
@@ -140,58 +152,161 @@ def median_price_listings(df_own):
     return df_own["price"].median()
 
 
-def create_price_histogram(df_own, col_name):
-    fig = px.histogram(
-        df_own,
+histogram_colors = [
+    "#2E86AB",
+    "#F6D55C",
+    "#3CAEA3",
+    "#ED553B",
+    "#173F5F",
+    "#20639B",
+    "#E94E77",
+    "#F6AB6C",
+    "#96CEB4",
+    "#5D5C61",
+]
+
+
+# bin edges and per city counts, binned with numpy on the server
+def price_histogram_counts(df_own, col_name, nbins=12, log=False):
+    df_own = as_broker_listings(df_own).frame([col_name, "city"])
+    values = df_own[col_name].to_numpy(dtype="float64", na_value=np.nan)
+    keep = ~np.isnan(values)
+    if log:
+        keep &= values > 0
+    cities, city_names = pd.factorize(df_own["city"].to_numpy()[keep], sort=True)
+    # listings without a city are left out, as the plotly histogram did
+    values, cities = values[keep][cities >= 0], cities[cities >= 0]
+    if len(values) == 0:
+        return np.zeros(nbins + 1), city_names, np.zeros((len(city_names), nbins))
+
+    if log:
+        values = np.log10(values)
+    edges = np.histogram_bin_edges(values, bins=nbins)
+    # the last bin includes its right edge, as in np.histogram
+    bins = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, nbins - 1)
+    counts = np.bincount(
+        cities * nbins + bins, minlength=len(city_names) * nbins
+    ).reshape(len(city_names), nbins)
+    return edges, city_names, counts
+
+
+# price histogram as stacked bars, the figure only carries the bin edges and
+# the counts per city instead of every price
+def create_price_histogram(df_own, col_name, nbins=12, log=False):
+    import plotly.graph_objects as go
+
+    edges, city_names, counts = price_histogram_counts(df_own, col_name, nbins, log)
+    centers = (edges[:-1] + edges[1:]) / 2
+    widths = np.diff(edges)
+    low, high = (10**edges if log else edges)[:-1], (10**edges if log else edges)[1:]
+    ranges = [f"${a:,.0f} - ${b:,.0f}" for a, b in zip(low, high)]
+
+    fig = go.Figure()
+    for i, city in enumerate(city_names):
+        fig.add_trace(
+            go.Bar(
+                x=centers,
+                y=counts[i],
+                width=widths,
+                name=city,
+                customdata=ranges,
+                marker_color=histogram_colors[i % len(histogram_colors)],
+                hovertemplate=f"city={city}<br>"
+                + col_name
+                + "=%{customdata}<br>count=%{y}<extra></extra>",
+            )
+        )
+    fig.update_traces(marker={"line": {"width": 2, "color": "white"}})
+    fig.update_layout(
         title="Price distribution",
-        x=col_name,
-        nbins=12,
-        color="city",
-        color_discrete_sequence=[
-            "#2E86AB",
-            "#F6D55C",
-            "#3CAEA3",
-            "#ED553B",
-            "#173F5F",
-            "#20639B",
-            "#E94E77",
-            "#F6AB6C",
-            "#96CEB4",
-            "#5D5C61",
-        ],
+        barmode="stack",
+        bargap=0,
+        legend_title_text="city",
+        xaxis_title=col_name,
+        yaxis_title="count",
+        paper_bgcolor="white",
     )
-    fig.update_traces(marker={"line": {"width": 2, "color": "white"}})
-    fig.update_layout(paper_bgcolor="white")
+    if log:
+        # the bars are placed on log10(price), label the axis with prices
+        fig.update_xaxes(
+            tickvals=edges, ticktext=[f"${10**e:,.0f}" for e in edges]
+        )
     return fig
 
 
+# a scatter trace per city of the selected zip codes, drawn from the month x
+# zip matrices (see stats_matrix.py) like px.scatter(color="zip_name") does
+# from the long frame. returns the figure and (city, zip codes, color) of
+# every trace
+def create_stats_scatter(df, col_chosen, zip_selected, y_label, hover_data=()):
+    import plotly.graph_objects as go
+    from plotly.colors import qualitative
+
+    hover_data = [c for c in hover_data if c != col_chosen]
+    fig = go.Figure()
+    traces = []
+    series = stats_matrix(df).series(zip_selected, [col_chosen, *hover_data])
+    for i, (city, zips, dates, values) in enumerate(series):
+        color = qualitative.Plotly[i % len(qualitative.Plotly)]
+        fig.add_trace(
+            go.Scatter(
+                x=dates,
+                y=values[0],
+                mode="markers",
+                name=city,
+                legendgroup=city,
+                marker=dict(color=color),
+                customdata=np.column_stack(values[1:]) if hover_data else None,
+                hovertemplate=f"City={city}<br>Date=%{{x}}<br>{y_label}=%{{y}}"
+                + "".join(
+                    f"<br>{c}=%{{customdata[{j}]}}" for j, c in enumerate(hover_data)
+                )
+                + "<extra></extra>",
+            )
+        )
+        traces.append((city, zips, color))
+    fig.update_layout(
+        xaxis_title="Date",
+        yaxis_title=y_label,
+        legend_title_text="City",
+        legend_tracegroupgap=0,
+    )
+    return fig, traces
+
+
 # table 2 price
 def create_median_price_chart(df, col_chosen, zip_selected):
-    filtered_df = df[df["postal_code"].isin(zip_selected)]
+    import plotly.graph_objects as go
 
-    fig = px.scatter(
-        filtered_df,
-        x="month_date_yyyymm",
-        y=col_chosen,
-        labels={"month_date_yyyymm": "Date", col_chosen: "Price", "zip_name": "City"},
-        color="zip_name",
-        hover_data=["median_listing_price"],
-        trendline="lowess",
+    fig, traces = create_stats_scatter(
+        df, col_chosen, zip_selected, "Price", ["median_listing_price"]
     )
+
+    # LOWESS trendlines come from the cache instead of being refitted here.
+    # like trendline="lowess", there is one per city (a city can span
+    # several of the selected zip codes)
+    for city, zips, color in traces:
+        dates, fitted = trendline(df, col_chosen, zips)
+        fig.add_trace(
+            go.Scatter(
+                x=dates,
+                y=fitted,
+                mode="lines",
+                name=city,
+                legendgroup=city,
+                showlegend=False,
+                line=dict(color=color),
+                hovertemplate="<b>LOWESS trendline</b><br><br>"
+                + f"City={city}<br>Date=%{{x}}<br>"
+                + "Price=%{y} <b>(trend)</b><extra></extra>",
+            )
+        )
     fig.update_layout(paper_bgcolor="white", height=600)
     return fig, zip_selected
 
 # table 3 listings
 def create_listings_chart(df, col_chosen, zip_selected=["77546"]):
-    filtered_df = df[df["postal_code"].isin(zip_selected)]
-
-    fig = px.scatter(
-        filtered_df,
-        x="month_date_yyyymm",
-        y=col_chosen,
-        labels={"month_date_yyyymm": "Date", col_chosen: "Count", "zip_name": "City"},
-        color="zip_name",
-    )
+    fig, _ = create_stats_scatter(df, col_chosen, zip_selected, "Count")
     fig.update_layout(paper_bgcolor="white", height=600)
     return fig
 
@@ -199,13 +314,20 @@ def create_listings_chart(df, col_chosen, zip_selected=["77546"]):
 def create_current_listings_chart(
     df_current_listings, price, bed, bath, zip_selected=["77546"]
 ):
-    filtered_df = df_current_listings[
-        (df_current_listings["zip_code"].isin(zip_selected))
-        & (df_current_listings["price"] <= price)
-        & (df_current_listings["bed"] >= bed)
-        & (df_current_listings["bath"] >= bath)
-    ]
-    filtered_df.sort_values(by="price", ascending=True, inplace=True)
+    import plotly.express as px
+
+    # answered from the per-zip price index, already sorted by price
+    filtered_df = as_broker_listings(df_current_listings).filter(
+        price, bed, bath, zip_selected, sort=True
+    )
+
+    # large results are thinned out on the server and drawn with WebGL, so the
+    # payload and the render time stay bounded whatever the filter
+    matching = len(filtered_df)
+    if matching > MAX_SCATTER_POINTS:
+        filtered_df = decimate_listings(
+            filtered_df, "house_size", "price", MAX_SCATTER_POINTS
+        )
 
     fig = px.scatter(
         filtered_df,
@@ -214,82 +336,169 @@ def create_current_listings_chart(
         labels={"house_size": "House size", "price": "Price", "zip_code": "Zip code"},
         color="zip_code",
         custom_data=["links"],
+        render_mode="webgl" if len(filtered_df) > WEBGL_THRESHOLD else "svg",
     )
+    if len(filtered_df) < matching:
+        fig.update_layout(
+            title=f"Showing {len(filtered_df):,} of {matching:,} listings"
+        )
     fig.update_layout(paper_bgcolor="white", height=450)
     return fig
 
 
-def create_filterd_listings_table(df_current_listings, price, bed, bath, zip=["77546"]):
-    filtered_df = df_current_listings[
-        (df_current_listings["price"] <= price)
-        & (df_current_listings["bed"] >= bed)
-        & (df_current_listings["bath"] >= bath)
-        & (df_current_listings["zip_code"].isin(zip))
-    ]
-    fig = go.Figure(
-        data=[
-            go.Table(
-                header=dict(
-                    values=filtered_df[
-                        [
-                            "zip_code",
-                            "city",
-                            "street",
-                            "price",
-                            "house_size",
-                            "bed",
-                            "bath",
-                            "acre_lot",
-                            # "links",
-                        ]
-                    ].columns[:],
-                    align="left",
-                ),
-                cells=dict(
-                    values=filtered_df[
-                        [
-                            "zip_code",
-                            "city",
-                            "street",
-                            "price",
-                            "house_size",
-                            "bed",
-                            "bath",
-                            "acre_lot",
-                            # "links",
-                        ]
-                    ].values.T[:],
-                    align="left",
-                ),
-            )
-        ]
-    )
-    fig.update_layout(
-        paper_bgcolor="white", margin={"t": 0, "l": 0, "r": 0, "b": 0}, height=300
-    )
-
-    return fig
+# keep one listing per cell of a grid over (x, y). dense areas are thinned
+# out while isolated listings (the outliers) always keep their own cell, and
+# the number of points is bounded by the number of cells
+def decimate_listings(df, x, y, max_points):
+    xs = df[x].to_numpy(dtype="float64", na_value=np.nan)
+    ys = df[y].to_numpy(dtype="float64", na_value=np.nan)
+    drawable = ~(np.isnan(xs) | np.isnan(ys))
+    df, xs, ys = df[drawable], xs[drawable], ys[drawable]
+    if len(df) <= max_points:
+        return df
+
+    bins = int(np.sqrt(max_points))
+
+    def cell(values):
+        low, high = values.min(), values.max()
+        scaled = (values - low) / (high - low) if high > low else values * 0
+        return np.minimum((scaled * bins).astype(np.int64), bins - 1)
+
+    # the first listing of each cell, in the order of df (i.e. by price)
+    _, first = np.unique(cell(xs) * bins + cell(ys), return_index=True)
+    return df.iloc[np.sort(first)]
+
+
+# one page of the filtered listings for the custom paging DataTable
+def create_filterd_listings_table(
+    df_current_listings,
+    price,
+    bed,
+    bath,
+    zip=["77546"],
+    page_current=0,
+    page_size=20,
+    sort_by=None,
+    filter_query="",
+):
+    sort_by = sort_by or []
+    listings = as_broker_listings(df_current_listings)
+    column, desc = None, False
+    if sort_by:
+        column = sort_by[0]["column_id"]
+        desc = sort_by[0]["direction"] == "desc"
+    # without a table filter the listings are counted, sorted and paged where
+    # they are stored, only the rows of the page are read
+    if not filter_query:
+        matching = listings.count(price, bed, bath, zip)
+        page_count = max(-(-matching // page_size), 1)
+        page_current = min(page_current or 0, page_count - 1)
+        page = listings.page(
+            price, bed, bath, zip, page_current * page_size, page_size, column, desc
+        )
+        return to_records(page), page_count, page_current
+    # the filter result is already ordered by price, which covers the
+    # default sort of the table for free
+    price_order = column == "price" and not desc
+    filtered_df = listings.filter(price, bed, bath, zip, sort=price_order)
+    filtered_df = apply_table_filter(filtered_df, filter_query)
+    if column is not None and not price_order:
+        filtered_df = filtered_df.iloc[sort_order(filtered_df, column, desc)]
+
+    page_count = max(-(-len(filtered_df) // page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    page = filtered_df.iloc[
+        page_current * page_size : (page_current + 1) * page_size
+    ][listing_table_columns]
+    return to_records(page), page_count, page_current
+
+
+filter_operators = [
+    ["ge ", ">="],
+    ["le ", "<="],
+    ["lt ", "<"],
+    ["gt ", ">"],
+    ["ne ", "!="],
+    ["eq ", "="],
+    ["contains "],
+    ["datestartswith "],
+]
+
+
+# split "{price} >= 100000" into ("price", ">=", 100000)
+def split_filter_part(filter_part):
+    for operator_type in filter_operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find("{") + 1 : name_part.rfind("}")]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ""
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', "`"):
+                    value = value_part[1:-1].replace("\\" + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
+
+
+# apply the filter_query of a custom filtering DataTable
+def apply_table_filter(df, filter_query):
+    if not filter_query:
+        return df
+    for filter_part in filter_query.split(" && "):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in df:
+            continue
+        column = df[col_name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.astype(column.cat.categories.dtype)
+        # text columns such as zip_code: 77546.0 is typed as 77546
+        if column.dtype == object and isinstance(filter_value, float):
+            if filter_value.is_integer():
+                filter_value = str(int(filter_value))
+            else:
+                filter_value = str(filter_value)
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            # these operators match pandas series operator method names
+            df = df.loc[getattr(column, operator)(filter_value).fillna(False)]
+        elif operator == "contains":
+            df = df.loc[
+                column.astype(str).str.contains(str(filter_value), regex=False)
+            ]
+        elif operator == "datestartswith":
+            df = df.loc[column.astype(str).str.startswith(str(filter_value))]
+    return df
 
 
 def parse_contents(contents, filename, date):
-    content_type, content_string = contents.split(",")
-
-    decoded = base64.b64decode(content_string)
+    start = time.perf_counter()
     try:
-        if "csv" in filename:
-            # Assume that the user uploaded a CSV file
-            df_upload = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
-        elif "xls" in filename:
-            # Assume that the user uploaded an excel file
-            df_upload = pd.read_excel(io.BytesIO(decoded))
+        # only the first rows are parsed for the preview
+        df_upload = parse_upload(contents, filename, nrows=PREVIEW_ROWS)
+    except UploadError as e:
+        return html.Div([html.H5(filename), str(e), html.Hr()])
     except Exception as e:
         print(e)
         return html.Div(["There was an error processing this file."])
+    elapsed = time.perf_counter() - start
 
     return html.Div(
         [
             html.H5(filename),
             html.H6(datetime.datetime.fromtimestamp(date)),
+            html.Small(
+                f"{upload_size(contents) / 1024:,.0f} KB, "
+                f"preview parsed in {elapsed * 1000:,.0f} ms"
+            ),
             dash_table.DataTable(
                 df_upload.iloc[:10, 2:10].to_dict("records"),
                 [{"name": i, "id": i} for i in df_upload.iloc[:10, 2:10].columns],
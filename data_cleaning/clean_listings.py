@@ -0,0 +1,164 @@
+# import libraries
+import argparse
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# builds real_estate_broker_data_texas.csv from the nationwide realtor-data.csv
+# (formerly clean_stats_data.ipynb). the file is cut into blocks of bytes at
+# line boundaries; each block is parsed, filtered and given its synthetic
+# fields (date_published, date_sold, links) and rendered as csv in a worker
+# process, with a generator seeded by (seed, block number). the blocks are
+# written in file order, so the output only depends on the input, the seed
+# and the block size, not on the number of workers
+#
+#   python data_cleaning/clean_listings.py realtor-data.csv --workers 8
+
+BLOCK_BYTES = 64 * 1024 * 1024
+SEED = 0
+
+# listings are published at random between these dates, and sold 0-60 days
+# after being published unless they are still for sale
+PUBLISHED_START = "2024-01-01"
+PUBLISHED_END = "2024-06-30"
+MAX_DAYS_TO_SALE = 60
+# larger houses are treated as data errors
+MAX_HOUSE_SIZE = 20000
+
+new_columns = ["date_published", "date_sold", "links"]
+
+links_list = [
+    "https://www.zillow.com/homedetails/2902-Meridian-Bay-Ln-Dickinson-TX-77539/71472548_zpid/",
+    "https://www.zillow.com/homedetails/3015-Misty-Isle-Ct-Dickinson-TX-77539/59823326_zpid/",
+    "https://www.zillow.com/homedetails/203-Armand-Bay-Dr-Dickinson-TX-77539/50447427_zpid/",
+    "https://www.zillow.com/homedetails/201-Creekside-Dr-League-City-TX-77573/27647595_zpid/",
+    "https://www.zillow.com/homedetails/4508-Brookstone-Ln-League-City-TX-77573/50445179_zpid/",
+]
+
+
+# the csv lines of block `block`: from the first line starting in it to the
+# end of the line running over its end. block 0 starts after the header line
+def read_block(file, block, block_bytes, header_end):
+    start = max(block * block_bytes, header_end)
+    end = (block + 1) * block_bytes
+    with open(file, "rb") as f:
+        if start > header_end:
+            # the line running into this block belongs to the previous one
+            f.seek(start - 1)
+            f.readline()
+            start = f.tell()
+        if start >= end:
+            return b""
+        f.seek(start)
+        data = f.read(end - start)
+        if data and not data.endswith(b"\n"):
+            data += f.readline()
+    return data
+
+
+# the cleaned rows of block `block` as csv lines, without index and header
+def clean_block(file, block, columns, args):
+    data = read_block(file, block, args["block_bytes"], args["header_end"])
+    if not data:
+        return b""
+    df = pd.read_csv(io.BytesIO(data), header=None, names=columns)
+
+    # Texas listings with a price, without the oversized houses
+    df = df[
+        (df["state"] == args["state"])
+        & df["price"].notna()
+        & (df["house_size"] <= MAX_HOUSE_SIZE)
+    ]
+
+    rng = np.random.default_rng([args["seed"], block])
+    start = pd.Timestamp(args["start"], tz="UTC")
+    days = (pd.Timestamp(args["end"], tz="UTC") - start).days + 1
+    published = start + pd.to_timedelta(rng.integers(0, days, len(df)), unit="D")
+    to_sale = pd.to_timedelta(
+        rng.integers(0, MAX_DAYS_TO_SALE + 1, len(df)), unit="D"
+    )
+    sold = (published + to_sale).where(df["status"].to_numpy() != "for_sale")
+    df = df.assign(
+        date_published=published,
+        date_sold=sold,
+        links=np.array(links_list)[rng.integers(0, len(links_list), len(df))],
+    )
+    # formatting the rows is most of the work, so it is done here too
+    return df.to_csv(index=False, header=False).encode()
+
+
+def clean_listings(
+    file,
+    out,
+    state="Texas",
+    workers=None,
+    seed=SEED,
+    block_bytes=BLOCK_BYTES,
+    start=PUBLISHED_START,
+    end=PUBLISHED_END,
+):
+    with open(file, "rb") as f:
+        header = f.readline()
+        header_end = f.tell()
+    columns = header.decode().strip().split(",")
+    blocks = (os.path.getsize(file) + block_bytes - 1) // block_bytes
+    args = {
+        "state": state,
+        "seed": seed,
+        "block_bytes": block_bytes,
+        "header_end": header_end,
+        "start": start,
+        "end": end,
+    }
+
+    workers = workers or os.cpu_count() or 1
+    kept = 0
+    with open(out, "wb") as f, ProcessPoolExecutor(max_workers=workers) as executor:
+        f.write((",".join([""] + columns + new_columns) + "\n").encode())
+        pending = deque()
+        next_block = 0
+        while next_block < blocks or pending:
+            # a few blocks in flight per worker, so memory stays bounded
+            while next_block < blocks and len(pending) < 2 * workers:
+                pending.append(
+                    executor.submit(clean_block, file, next_block, columns, args)
+                )
+                next_block += 1
+            lines = pending.popleft().result().splitlines(keepends=True)
+            # number the rows in the first column, as the notebook's to_csv did
+            f.writelines(b"%d,%s" % (kept + i, line) for i, line in enumerate(lines))
+            kept += len(lines)
+    print(f"{file}: {blocks} blocks, kept {kept:,} listings, written to {out}")
+    return kept
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clean the realtor listings.")
+    parser.add_argument("file", nargs="?", default="realtor-data.csv")
+    parser.add_argument("--out", default="real_estate_broker_data_texas.csv")
+    parser.add_argument("--state", default="Texas")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--block-mb", type=int, default=BLOCK_BYTES // 1024**2)
+    parser.add_argument("--start", default=PUBLISHED_START)
+    parser.add_argument("--end", default=PUBLISHED_END)
+    args = parser.parse_args(argv)
+
+    clean_listings(
+        args.file,
+        args.out,
+        args.state,
+        args.workers,
+        args.seed,
+        args.block_mb * 1024**2,
+        args.start,
+        args.end,
+    )
+
+
+if __name__ == "__main__":
+    main()
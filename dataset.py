@@ -0,0 +1,192 @@
+# import libraries
+import itertools
+import os
+import threading
+import time
+
+from ingest import MERGED_DIR, apply_uploads, merge_staged, reapply_uploads
+from listings_frame import as_listings
+from preprocess import INGEST_CHUNKSIZE
+from snapshot import LISTINGS_FILE, STATS_FILE, load_listings, load_stats
+from startup import step
+from stats_matrix import stats_matrix
+from trendlines import precompute_trendlines
+
+# the data the app serves, as one versioned, immutable snapshot. callbacks read
+# `store.current` once and work on that object, so swapping in a new dataset
+# (a nightly data drop, merged uploads) never mixes two versions in one
+# response; in-flight callbacks finish on the version they started with
+
+# seconds between checks of the source files, DATA_POLL_SECONDS to override
+# (0 turns the watcher off)
+POLL_SECONDS = int(os.environ.get("DATA_POLL_SECONDS", 60))
+
+_versions = itertools.count(1)
+
+
+class Dataset:
+    def __init__(self, stats, listings, sources=None, warming=None, uploads=()):
+        self.version = next(_versions)
+        self.stats = stats  # the rdc stats frame, `df` in app.py
+        self.listings = listings
+        # the merged upload files included in the listings, see ingest.py
+        self.uploads = list(uploads)
+        self.zips = stats.postal_code.unique().tolist()
+        # (size, mtime) of the source files this dataset was built from
+        self.sources = sources or {}
+        self.loaded_at = time.time()
+        # the thread fitting the trendlines of this stats frame, see warm()
+        self.warming = warming
+
+    # fit the median price trendlines in the background. the app serves
+    # meanwhile (a trendline not fitted yet is fitted on first use), and
+    # statsmodels is not imported on the startup path
+    def warm(self):
+        def run():
+            with step("precompute_trendlines"):
+                precompute_trendlines(self.stats)
+
+        self.warming = threading.Thread(target=run, name="warm-trendlines", daemon=True)
+        self.warming.start()
+        return self
+
+    # a new version of this dataset with other listings, e.g. after an upload
+    def with_listings(self, listings, uploads=None):
+        if uploads is None:
+            uploads = self.uploads
+        return Dataset(self.stats, listings, self.sources, self.warming, uploads)
+
+    # a new version with the staged uploads merged into the listings
+    def merge(self, staged, merged_dir=MERGED_DIR):
+        listings, paths = merge_staged(self.listings, staged, merged_dir)
+        dataset = self.with_listings(listings, self.uploads + paths)
+        # the merge wrote to a database source itself, that is not a change
+        # of the source for the watcher to reload
+        if as_listings(listings).keeps_uploads:
+            dataset.sources = {**self.sources, **source_state([listings.path])}
+        return dataset
+
+    # this dataset with the uploads `other` has merged and this one has not,
+    # i.e. merged while this one was loading
+    def catch_up(self, other):
+        missing = [p for p in other.uploads if p not in self.uploads]
+        if not missing:
+            return self
+        listings = apply_uploads(self.listings, missing)
+        return self.with_listings(listings, self.uploads + missing)
+
+
+def source_state(files):
+    state = {}
+    for file in files:
+        try:
+            stat = os.stat(file)
+            state[file] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            state[file] = None
+    return state
+
+
+# load both files (from the parquet snapshots when they are up to date), apply
+# the uploads merged so far and prepare everything that is computed once per
+# load
+def load_dataset(
+    stats_file=STATS_FILE, listings_file=LISTINGS_FILE, merged_dir=MERGED_DIR
+):
+    sources = source_state([stats_file, listings_file])
+    with step("load_stats"):
+        stats = load_stats(stats_file, chunksize=INGEST_CHUNKSIZE)
+    with step("load_listings"):
+        listings = load_listings(listings_file, chunksize=INGEST_CHUNKSIZE)
+        listings, uploads = reapply_uploads(listings, merged_dir)
+    # the month x zip matrices of the price and listings charts
+    with step("stats_matrix"):
+        stats_matrix(stats)
+    return Dataset(stats, listings, sources, uploads=uploads).warm()
+
+
+class DatasetStore:
+    def __init__(
+        self, stats_file=STATS_FILE, listings_file=LISTINGS_FILE, merged_dir=MERGED_DIR
+    ):
+        self.files = [stats_file, listings_file]
+        self.merged_dir = merged_dir
+        self.current = load_dataset(stats_file, listings_file, merged_dir)
+        # what a settled change of the source files or a merged upload calls
+        # instead of a reload here. serve.py has the gunicorn master reload,
+        # so that every worker is forked from the new dataset
+        self.on_change = None
+        # called with every dataset swapped in, e.g. to drop cached figures
+        # of the replaced one
+        self.on_swap = None
+        self._lock = threading.Lock()
+        self._thread = None
+        # a forked server worker does not inherit the watcher thread
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def version(self):
+        return self.current.version
+
+    # swap in a new dataset, built from the current one by `build`. upload
+    # merges and the swap of a reload are serialised, so neither loses the
+    # other's change
+    def update(self, build):
+        with self._lock:
+            dataset = build(self.current)
+            # a single reference assignment, readers see the old or new one
+            self.current = dataset
+        print(f"dataset version {dataset.version} loaded")
+        if self.on_swap is not None:
+            self.on_swap(dataset)
+        return dataset
+
+    def merge(self, staged):
+        dataset = self.update(lambda current: current.merge(staged, self.merged_dir))
+        if self.on_change is not None:
+            self.on_change()
+        return dataset
+
+    # the new dataset is loaded without the lock, upload merges go on
+    # meanwhile and are caught up with when it is swapped in
+    def reload(self):
+        dataset = load_dataset(*self.files, self.merged_dir)
+        return self.update(lambda current: dataset.catch_up(current))
+
+    # poll the source files and reload once a change has settled, i.e. the
+    # files look the same on two checks in a row (not half written)
+    def watch(self, interval=POLL_SECONDS):
+        if not interval or (self._thread is not None and self._thread.is_alive()):
+            return self
+        self._thread = threading.Thread(
+            target=self._watch, args=(interval,), name="dataset-watch", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _watch(self, interval):
+        seen = handled = self.current.sources
+        while True:
+            time.sleep(interval)
+            state = source_state(self.files)
+            # a change is handled once, also while its reload is still running
+            if state in (self.current.sources, handled) or None in state.values():
+                seen = state
+                continue
+            if state != seen:
+                seen = state
+                continue
+            handled = state
+            try:
+                if self.on_change is not None:
+                    self.on_change()
+                else:
+                    self.reload()
+            except Exception as e:
+                # keep serving the previous version
+                print(e)
@@ -0,0 +1,138 @@
+# import libraries
+import os
+import time
+import uuid
+
+import pandas as pd
+
+from listings_frame import as_listings
+from preprocess import included_postal_codes, listing_columns, prepare_listings
+from schema import conform, listing_schema
+from upload import UploadError, parse_upload
+
+# ingest of uploaded listing files into the live dataset. parsing, validation
+# and preprocessing run in a dash background callback (a separate process),
+# which stages the prepared rows as parquet; the server process then only
+# has to read and append them, see merge_staged
+
+STAGING_DIR = "uploads"
+# merged uploads, applied again on every load of the listings
+MERGED_DIR = os.path.join(STAGING_DIR, "merged")
+
+# columns an uploaded listings file must have, the other listing columns are
+# filled with missing values when absent
+required_listing_columns = [
+    "brokered_by",
+    "status",
+    "price",
+    "bed",
+    "bath",
+    "city",
+    "zip_code",
+    "house_size",
+]
+
+
+def validate_listings(df, filename):
+    missing = [c for c in required_listing_columns if c not in df]
+    if missing:
+        raise UploadError(f"{filename} is missing the columns {', '.join(missing)}.")
+    for col in ["price", "bed", "bath", "house_size", "zip_code"]:
+        values = pd.to_numeric(df[col], errors="coerce")
+        if values.isna().all() and len(df):
+            raise UploadError(f"{filename}: column {col} has no numeric values.")
+
+
+# parse, validate and preprocess one upload like preprocess_listings does,
+# and stage the result. returns (path, rows) or raises UploadError
+def stage_upload(contents, filename, staging_dir=STAGING_DIR):
+    df = parse_upload(contents, filename)
+    validate_listings(df, filename)
+    df = df.reindex(columns=listing_columns)
+    df = prepare_listings(df, included_postal_codes)
+
+    os.makedirs(staging_dir, exist_ok=True)
+    path = os.path.join(staging_dir, f"{uuid.uuid4().hex}.parquet")
+    df.to_parquet(path)
+    return path, len(df)
+
+
+# background job body: stage every file, reporting progress as (done, total)
+def stage_uploads(list_of_contents, list_of_names, set_progress=None):
+    staged, errors = [], []
+    total = len(list_of_contents)
+    for i, (contents, filename) in enumerate(zip(list_of_contents, list_of_names)):
+        try:
+            path, rows = stage_upload(contents, filename)
+            staged.append({"file": filename, "path": path, "rows": rows})
+        except UploadError as e:
+            errors.append(str(e))
+        except Exception as e:
+            print(e)
+            errors.append(f"There was an error processing {filename}.")
+        if set_progress is not None:
+            set_progress((str(i + 1), str(total)))
+    return {"staged": staged, "errors": errors}
+
+
+# append staged uploads to the listings, returning the new listings and the
+# merged files. listings that keep their uploads (a ListingsDB) have them
+# written and the staged files are removed; otherwise they are kept in
+# merged_dir, so every later load of the source files (a reload, a restart)
+# applies them again
+def merge_staged(df_listings, staged, merged_dir=MERGED_DIR):
+    listings = as_listings(df_listings)
+    merged = listings.append(read_uploads(item["path"] for item in staged))
+    if listings.keeps_uploads:
+        remove_staged(staged)
+        return merged, []
+    return merged, keep_merged(staged, merged_dir)
+
+
+def read_uploads(paths):
+    return [conform(pd.read_parquet(path), listing_schema) for path in paths]
+
+
+def apply_uploads(df_listings, paths):
+    if not paths:
+        return df_listings
+    return as_listings(df_listings).append(read_uploads(paths))
+
+
+# move merged uploads to merged_dir, named so that they sort in merge order
+def keep_merged(staged, merged_dir=MERGED_DIR):
+    os.makedirs(merged_dir, exist_ok=True)
+    kept = []
+    for item in staged:
+        name = f"{time.time_ns():020d}-{os.path.basename(item['path'])}"
+        path = os.path.join(merged_dir, name)
+        os.replace(item["path"], path)
+        kept.append(path)
+    return kept
+
+
+# the uploads merged so far, in merge order. they stay until a data drop
+# includes them and the directory is emptied
+def merged_uploads(merged_dir=MERGED_DIR):
+    try:
+        names = sorted(os.listdir(merged_dir))
+    except OSError:
+        return []
+    return [os.path.join(merged_dir, n) for n in names if n.endswith(".parquet")]
+
+
+# the listings with the merged uploads applied again after a load, and the
+# files applied. listings that keep their uploads hold them already
+def reapply_uploads(df_listings, merged_dir=MERGED_DIR):
+    if as_listings(df_listings).keeps_uploads:
+        return df_listings, []
+    paths = merged_uploads(merged_dir)
+    return apply_uploads(df_listings, paths), paths
+
+
+def remove_staged(staged):
+    for item in staged:
+        try:
+            os.remove(item["path"])
+        except OSError:
+            pass
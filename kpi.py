@@ -0,0 +1,141 @@
+# import libraries
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pandas as pd
+
+from listings_frame import as_broker_listings
+
+# dashboard KPIs computed in one pass into an immutable snapshot, refreshed by a
+# background thread so page loads and callbacks only ever read the snapshot
+
+
+@dataclass(frozen=True)
+class KpiSnapshot:
+    total_sales: float  # sales value in the current month
+    active_listings: int
+    highest_closing: float
+    sold_last_quarter: int
+    median_price: float
+    computed_at: pd.Timestamp
+
+    @property
+    def month_label(self):
+        return self.computed_at.strftime("%m/%Y")
+
+    @property
+    def year_label(self):
+        return self.computed_at.strftime("%Y")
+
+
+# all KPIs in one pass over the broker's listings (one aggregate query in a
+# ListingsDB), the same figures as total_sales, current_number_of_listings,
+# highest_closing, sold_last_quarter and median_price_listings in
+# create_charts.py
+def compute_kpis(df_own, now=None):
+    now = pd.Timestamp.now() if now is None else now
+    return KpiSnapshot(**as_broker_listings(df_own).kpis(now), computed_at=now)
+
+
+# keeps the latest KpiSnapshot of every broker that was asked for up to date
+# in a daemon thread. get_frame(key) returns the listings of a key (broker).
+# a key's first snapshot is computed on request, after that it is recomputed
+# every `interval` seconds, right after midnight (so "this month" rolls over),
+# when get_frame() returns a different frame, or when invalidate() is called.
+# only the `max_keys` most recently requested keys are kept
+class KpiEngine:
+    def __init__(self, get_frame, interval=300, max_keys=512):
+        self.get_frame = get_frame
+        self.interval = interval
+        self.max_keys = max_keys
+        self._snapshots = OrderedDict()  # key -> (frame, snapshot)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        # a forked child (a server worker) gets the snapshots but not the
+        # thread; start() there starts its own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._snapshots.get(key)
+            if entry is not None:
+                self._snapshots.move_to_end(key)
+                return entry[1]
+        return self.refresh(key)
+
+    def refresh(self, key):
+        df_own = self.get_frame(key)
+        snapshot = compute_kpis(df_own)
+        # readers never see a partially built snapshot, only the old or new one
+        with self._lock:
+            self._snapshots[key] = (df_own, snapshot)
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.max_keys:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    def refresh_all(self):
+        with self._lock:
+            keys = list(self._snapshots)
+        for key in keys:
+            self.refresh(key)
+
+    def invalidate(self):
+        self._wake.set()
+
+    # build the snapshots of `keys` before serving, so their page loads never
+    # wait
+    def prefetch(self, keys):
+        for key in keys:
+            self.refresh(key)
+        return self
+
+    # start the refresh thread, once per process
+    def start(self, keys=()):
+        self.prefetch(keys)
+        if self._thread is not None:
+            return self
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._thread = threading.Thread(
+                target=self._run, name="kpi-refresh", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _seconds_until_midnight(self):
+        now = pd.Timestamp.now()
+        return (now.normalize() + pd.Timedelta(days=1) - now).total_seconds()
+
+    def _frames_changed(self):
+        with self._lock:
+            entries = list(self._snapshots.items())
+        return any(self.get_frame(key) is not frame for key, (frame, _) in entries)
+
+    def _run(self):
+        while True:
+            timeout = min(self.interval, self._seconds_until_midnight() + 1)
+            deadline = time.monotonic() + timeout
+            # poll for new frames every few seconds until the deadline
+            while time.monotonic() < deadline:
+                if self._wake.wait(min(5, max(deadline - time.monotonic(), 0))):
+                    break
+                if self._frames_changed():
+                    break
+            self._wake.clear()
+            try:
+                self.refresh_all()
+            except Exception as e:
+                # keep serving the previous snapshots
+                print(e)
@@ -0,0 +1,382 @@
+# import libraries
+import argparse
+import itertools
+import os
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from preprocess import (
+    INGEST_CHUNKSIZE,
+    included_postal_codes,
+    listing_columns,
+    prepare_listings,
+)
+from schema import apply_listing_schema, listing_read_dtypes, listing_table_columns
+
+# listings in a local sqlite file instead of a frame in memory, for data sets
+# too large to hold in every server process (several states of the realtor
+# data). ListingsDB and BrokerListings implement the listings interface of
+# listings_frame.py: the chart, table and KPI functions query a broker's
+# listings for the rows or aggregates they need, so memory is bounded by query
+# results, not by the size of the data
+#
+#   python listings_db.py real_estate_broker_data_texas.csv --db listings.db
+#
+# and start the app with LISTINGS_FILE=listings.db (see snapshot.py)
+
+# read connections per process, shared by the callback threads
+POOL_SIZE = int(os.environ.get("LISTINGS_DB_POOL", 8))
+
+# street ids are numbers, street names text, so the column has no type
+create_table = """
+CREATE TABLE listings (
+    brokered_by INTEGER,
+    status TEXT,
+    price REAL,
+    bed INTEGER,
+    bath INTEGER,
+    acre_lot REAL,
+    street,
+    city TEXT,
+    zip_code TEXT,
+    house_size REAL,
+    date_published TEXT,
+    date_sold TEXT,
+    links TEXT
+)
+"""
+# the broker's KPIs, recent sales and sales per period, and the Current
+# Listings filter (zip code, max price, min bed / bath). the last column of
+# each makes it covering: the KPIs and the filter count never read the table
+create_indexes = [
+    "CREATE INDEX listings_broker ON listings "
+    "(brokered_by, status, date_sold, price)",
+    "CREATE INDEX listings_filter ON listings "
+    "(zip_code, price, bed, bath, brokered_by)",
+]
+# brokers with more listings than this are filtered on listings_filter, the
+# others on their rows in listings_broker. sqlite's statistics only know the
+# average broker, so it picks listings_broker for the large ones too
+FILTER_INDEX_ROWS = 5000
+db_date_columns = ["date_published", "date_sold"]
+
+_versions = itertools.count(1)
+
+# the open databases. sqlite connections must not be used across a fork, a
+# server worker opens its own; one fork hook for all of them, which does not
+# keep a database alive
+_databases = weakref.WeakSet()
+
+
+def _after_fork():
+    for db in list(_databases):
+        db._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def is_listings_db(file):
+    try:
+        with open(file, "rb") as f:
+            return f.read(16) == b"SQLite format 3\x00"
+    except OSError:
+        return False
+
+
+# preprocessed listings as rows for the table: dates as yyyy-mm-dd text (which
+# sorts and compares like the dates), missing values as NULL
+def to_db(df):
+    df = df.reindex(columns=listing_columns)
+    for col in db_date_columns:
+        df[col] = df[col].dt.strftime("%Y-%m-%d")
+    df = df.astype(object)
+    return df.where(df.notna(), None)
+
+
+# a time to compare with the date columns. '2024-05-01' < '2024-05-01 10:00'
+# as text, so dates compare with a time like the day precision datetimes do
+def db_time(ts):
+    return str(ts.date()) if ts == ts.normalize() else ts.isoformat()
+
+
+class ListingsDB:
+    # uploads are written to the database, see ingest.py
+    keeps_uploads = True
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = str(path)
+        self.version = next(_versions)
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        _databases.add(self)
+
+    def _after_fork(self):
+        self._pool = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    # close the pooled connections. callbacks still running on this version
+    # finish, their connections are closed when returned
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # a pooled read-only connection. up to pool_size are opened, further
+    # callers wait for one to be returned
+    @contextmanager
+    def connection(self):
+        try:
+            con = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.pool_size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                uri = Path(self.path).resolve().as_uri() + "?mode=ro"
+                con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                con = self._pool.get()
+        try:
+            yield con
+        finally:
+            if self._closed:
+                con.close()
+            else:
+                self._pool.put(con)
+
+    def read(self, sql, params=()):
+        with self.connection() as con:
+            df = pd.read_sql_query(sql, con, params=params)
+        return apply_listing_schema(df)
+
+    def fetchone(self, sql, params=()):
+        with self.connection() as con:
+            return con.execute(sql, params).fetchone()
+
+    def __len__(self):
+        return self.fetchone("SELECT COUNT(*) FROM listings")[0]
+
+    # broker id -> number of listings, the largest brokers first
+    def broker_counts(self):
+        with self.connection() as con:
+            rows = con.execute(
+                "SELECT brokered_by, COUNT(*) AS n FROM listings "
+                "WHERE brokered_by IS NOT NULL "
+                "GROUP BY brokered_by ORDER BY n DESC, brokered_by"
+            ).fetchall()
+        return {int(b): n for b, n in rows}
+
+    def broker(self, broker, rows=0):
+        return BrokerListings(self, broker, rows)
+
+    # append preprocessed listings (uploads), returning the database as a new
+    # version so that everything cached for the old one is rebuilt. this
+    # version's connections are closed
+    def append(self, frames):
+        with sqlite3.connect(self.path, timeout=30) as con:
+            for df in frames:
+                to_db(df).to_sql("listings", con, if_exists="append", index=False)
+        con.close()
+        self.close()
+        return ListingsDB(self.path, self.pool_size)
+
+
+# the listings of one broker in a ListingsDB, passed where the in-memory code
+# takes df_own. every method is one query for what a figure or table needs
+class BrokerListings:
+    def __init__(self, db, broker, rows=0):
+        self.db = db
+        self.broker = int(broker)
+        self.rows = rows
+
+    def _filter(self, price, bed, bath, zip_selected):
+        zips = [str(z) for z in zip_selected]
+        index = "listings_broker"
+        if self.rows > FILTER_INDEX_ROWS:
+            index = "listings_filter"
+        sql = (
+            f"FROM listings INDEXED BY {index} WHERE brokered_by = ? "
+            f"AND zip_code IN ({', '.join('?' * len(zips))}) "
+            f"AND price <= ? AND bed >= ? AND bath >= ?"
+        )
+        return sql, [self.broker, *zips, float(price), int(bed), int(bath)]
+
+    # the Current Listings filter, ordered by price when sort=True
+    def filter(self, price, bed, bath, zip_selected, sort=False):
+        where, params = self._filter(price, bed, bath, zip_selected)
+        columns = ", ".join(listing_table_columns + ["links"])
+        order = "price, rowid" if sort else "rowid"
+        return self.db.read(f"SELECT {columns} {where} ORDER BY {order}", params)
+
+    def count(self, price, bed, bath, zip_selected):
+        where, params = self._filter(price, bed, bath, zip_selected)
+        return self.db.fetchone(f"SELECT COUNT(*) {where}", params)[0]
+
+    # one page of the filtered listings, sorted by a table column (missing
+    # values last) or in table order
+    def page(
+        self, price, bed, bath, zip_selected, offset, limit, column=None, desc=False
+    ):
+        where, params = self._filter(price, bed, bath, zip_selected)
+        order = "rowid"
+        if column in listing_table_columns:
+            order = f"{column} IS NULL, {column} {'DESC' if desc else 'ASC'}, rowid"
+        return self.db.read(
+            f"SELECT {', '.join(listing_table_columns)} {where} "
+            f"ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [int(limit), int(offset)],
+        )
+
+    # sum of the prices per month (freq="M") or week (freq="W", starting on
+    # monday) of the rows with date_column in [start, end]
+    def period_sales(self, date_column, freq, start, end):
+        if date_column not in db_date_columns:
+            raise ValueError(f"not a date column: {date_column}")
+        if freq == "W":
+            period = (
+                f"date({date_column}, '-' || ((CAST(strftime('%w', {date_column}) "
+                f"AS INTEGER) + 6) % 7) || ' days')"
+            )
+        else:
+            period = f"substr({date_column}, 1, 7)"
+        with self.db.connection() as con:
+            rows = con.execute(
+                f"SELECT {period} AS period, TOTAL(price) FROM listings "
+                f"WHERE brokered_by = ? AND {date_column} >= ? "
+                f"AND {date_column} <= ? GROUP BY period",
+                [self.broker, db_time(start), db_time(end)],
+            ).fetchall()
+        return pd.Series(
+            [s for _, s in rows],
+            index=pd.PeriodIndex([pd.Timestamp(p) for p, _ in rows], freq=freq),
+            dtype="float64",
+        )
+
+    # the figures of kpi.compute_kpis, as keyword arguments of a KpiSnapshot
+    def kpis(self, now):
+        first_day_current_month = now.normalize().replace(day=1)
+        past_quarter_begins = now - pd.DateOffset(months=3)
+        total, active, highest, quarter, priced = self.db.fetchone(
+            "SELECT "
+            "TOTAL(CASE WHEN status = 'sold' AND date_sold >= :month "
+            "AND date_sold <= :now THEN price END), "
+            "COUNT(CASE WHEN status = 'for_sale' THEN 1 END), "
+            "MAX(CASE WHEN status = 'sold' THEN price END), "
+            "COUNT(CASE WHEN status = 'sold' AND date_sold > :quarter THEN 1 END), "
+            "COUNT(price) "
+            "FROM listings WHERE brokered_by = :broker",
+            {
+                "month": db_time(first_day_current_month),
+                "now": db_time(now),
+                "quarter": db_time(past_quarter_begins),
+                "broker": self.broker,
+            },
+        )
+        return {
+            "total_sales": float(total),
+            "active_listings": int(active),
+            "highest_closing": np.nan if highest is None else float(highest),
+            "sold_last_quarter": int(quarter),
+            "median_price": self.median_price(priced),
+        }
+
+    # the median of the `priced` prices, the middle one or two rows in order
+    def median_price(self, priced):
+        if not priced:
+            return np.nan
+        with self.db.connection() as con:
+            rows = con.execute(
+                "SELECT price FROM listings WHERE brokered_by = ? "
+                "AND price IS NOT NULL ORDER BY price LIMIT ? OFFSET ?",
+                [self.broker, 2 - priced % 2, (priced - 1) // 2],
+            ).fetchall()
+        return float(np.mean([p for (p,) in rows]))
+
+    # the n latest listings with `status`, by date_column
+    def latest(self, status, date_column, columns, n=7):
+        return self.db.read(
+            f"SELECT {', '.join([date_column] + columns)} FROM listings "
+            f"WHERE brokered_by = ? AND status = ? "
+            f"ORDER BY {date_column} DESC LIMIT ?",
+            [self.broker, status, int(n)],
+        )
+
+    # a few columns of all the broker's listings, e.g. for the histogram
+    def frame(self, columns):
+        return self.db.read(
+            f"SELECT {', '.join(columns)} FROM listings WHERE brokered_by = ?",
+            [self.broker],
+        )
+
+
+# write the listings of `file` in the included zip codes to a new database,
+# streaming the csv in chunks
+def build_listings_db(
+    file, path, zips=included_postal_codes, chunksize=INGEST_CHUNKSIZE
+):
+    tmp = f"{path}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    con = sqlite3.connect(tmp)
+    con.execute(create_table)
+    rows = 0
+    reader = pd.read_csv(
+        file,
+        usecols=lambda c: c in listing_columns,
+        dtype=listing_read_dtypes,
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        chunk = prepare_listings(chunk, zips)
+        to_db(chunk).to_sql("listings", con, if_exists="append", index=False)
+        rows += len(chunk)
+    # indexes after the inserts, one sort each instead of updates per row
+    for sql in create_indexes:
+        con.execute(sql)
+    con.execute("ANALYZE")
+    con.commit()
+    con.close()
+    os.replace(tmp, path)
+    print(f"{rows:,} listings written to {path}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the listings database.")
+    parser.add_argument("file", nargs="?", default="real_estate_broker_data_texas.csv")
+    parser.add_argument("--db", default="listings.db")
+    parser.add_argument(
+        "--zips",
+        nargs="+",
+        type=int,
+        default=included_postal_codes,
+        help="zip codes to keep, the dashboard's by default",
+    )
+    parser.add_argument("--chunksize", type=int, default=INGEST_CHUNKSIZE)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    build_listings_db(args.file, args.db, args.zips, args.chunksize)
+    print(f"built in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# import libraries
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, frame_version
+from listings_index import filter_listings, filter_positions
+from schema import concat_frames, listing_table_columns
+
+# the listings interface the chart, table, KPI, broker and ingest code calls,
+# and its in-memory implementation. listings_db.py implements the same
+# methods on sqlite (ListingsDB, BrokerListings):
+#
+#   all listings      broker_counts(), broker(broker, rows), append(frames),
+#                     keeps_uploads
+#   one broker's      filter, count, page, period_sales, kpis, latest, frame
+#
+# callers wrap what they are given with as_listings / as_broker_listings and
+# never check which storage it is
+
+
+# a broker's listings frame (df_own)
+class FrameListings:
+    def __init__(self, df):
+        self.df = df
+
+    # the Current Listings filter, ordered by price when sort=True
+    def filter(self, price, bed, bath, zip_selected, sort=False):
+        return filter_listings(self.df, price, bed, bath, zip_selected, sort)
+
+    def count(self, price, bed, bath, zip_selected):
+        return len(filter_positions(self.df, price, bed, bath, zip_selected, True))
+
+    # one page of the filtered listings, sorted by a table column (missing
+    # values last) or in frame order. the filter result is already ordered by
+    # price, which covers the default sort of the table for free
+    def page(
+        self, price, bed, bath, zip_selected, offset, limit, column=None, desc=False
+    ):
+        price_order = column == "price" and not desc
+        rows = self.filter(price, bed, bath, zip_selected, sort=price_order)
+        if column in listing_table_columns and not price_order:
+            rows = rows.iloc[sort_order(rows, column, desc)]
+        return rows.iloc[offset : offset + limit][listing_table_columns]
+
+    # sum of the prices per month (freq="M") or week (freq="W") of the rows
+    # with date_column in [start, end]. the finished periods come from
+    # closed_sales_cache, only the current one is summed on every call
+    def period_sales(self, date_column, freq, start, end):
+        df = self.df
+        current = end.to_period(freq)
+        closed = closed_period_sales(df, date_column, freq, current)
+        sales = closed[closed.index >= start.to_period(freq)]
+        current_start = max(current.start_time, start)
+        dates = df[date_column]
+        partial = df.loc[(dates >= current_start) & (dates <= end), "price"]
+        sales = pd.concat(
+            [sales, pd.Series([partial.astype(float).sum()], index=[current])]
+        )
+        return sales.astype("float64")
+
+    # the figures of kpi.compute_kpis from one set of column arrays, as
+    # keyword arguments of a KpiSnapshot
+    def kpis(self, now):
+        df = self.df
+        first_day_current_month = now.normalize().replace(day=1)
+        past_quarter_begins = now - pd.DateOffset(months=3)
+
+        status = df["status"]
+        sold = (status == "sold").to_numpy()
+        for_sale = (status == "for_sale").to_numpy()
+        price = df["price"].to_numpy(dtype="float64", na_value=np.nan)
+        # NaT compares False against any date, so unsold rows drop out naturally
+        date_sold = df["date_sold"].to_numpy()
+
+        sold_this_month = (
+            sold
+            & (date_sold >= first_day_current_month.to_datetime64())
+            & (date_sold <= now.to_datetime64())
+        )
+        sold_quarter = sold & (date_sold > past_quarter_begins.to_datetime64())
+        sold_prices = price[sold]
+
+        return {
+            "total_sales": float(np.nansum(price[sold_this_month])),
+            "active_listings": int(for_sale.sum()),
+            "highest_closing": (
+                float(np.nanmax(sold_prices)) if sold_prices.size else np.nan
+            ),
+            "sold_last_quarter": int(sold_quarter.sum()),
+            "median_price": float(np.nanmedian(price)) if price.size else np.nan,
+        }
+
+    # the n latest listings with `status`, by date_column
+    def latest(self, status, date_column, columns, n=7):
+        df = self.df
+        return (
+            df[df["status"] == status][[date_column] + columns]
+            .sort_values(date_column, ascending=False)
+            .head(n)
+        )
+
+    # a frame with (at least) these columns, e.g. for the histogram
+    def frame(self, columns):
+        return self.df
+
+
+# the listings frame of a dataset, partitioned by broker on first use
+class ListingsFrame:
+    # uploads are appended to a new frame in memory, see ingest.py
+    keeps_uploads = False
+
+    def __init__(self, df):
+        self.df = df
+
+    # row positions per brokered_by, in frame order
+    @cached_property
+    def partitions(self):
+        brokers = self.df["brokered_by"].to_numpy(dtype="float64", na_value=np.nan)
+        # one stable sort groups the rows of each broker, in frame order
+        order = np.argsort(brokers, kind="stable")
+        ids, starts, counts = np.unique(
+            brokers[order], return_index=True, return_counts=True
+        )
+        keep = ~np.isnan(ids)
+        return {
+            int(b): order[s : s + c]
+            for b, s, c in zip(ids[keep], starts[keep], counts[keep])
+        }
+
+    # broker id -> number of listings, the largest brokers first
+    def broker_counts(self):
+        counts = {b: len(rows) for b, rows in self.partitions.items()}
+        return dict(sorted(counts.items(), key=lambda item: -item[1]))
+
+    def broker(self, broker, rows=0):
+        return self.df.iloc[self.partitions.get(int(broker), np.empty(0, int))]
+
+    # the frame with preprocessed listings (uploads) appended, as a new frame
+    def append(self, frames):
+        live = self.df
+        parts = [live]
+        for df in frames:
+            # same columns as the live frame, with its dtypes for the missing ones
+            df = df.reindex(columns=live.columns)
+            for col in live.columns:
+                if df[col].isna().all() and df[col].dtype != live[col].dtype:
+                    df[col] = pd.Series(index=df.index, dtype=live[col].dtype)
+            parts.append(df)
+        return concat_frames(parts) if len(parts) > 1 else live
+
+
+def as_listings(df_listings):
+    if isinstance(df_listings, pd.DataFrame):
+        return ListingsFrame(df_listings)
+    return df_listings
+
+
+def as_broker_listings(df_own):
+    if isinstance(df_own, pd.DataFrame):
+        return FrameListings(df_own)
+    return df_own
+
+
+# sales per finished period, keyed on (frame, date column, freq, current
+# period). the sums of finished months / weeks never change for a given frame,
+# so they are computed with one groupby and reused until the current period
+# rolls over
+closed_sales_cache = LRUCache(maxsize=256, name="closed_sales")
+
+
+def closed_period_sales(df, date_column, freq, current):
+    def compute():
+        periods = df[date_column].dt.to_period(freq)
+        sales = df["price"].astype(float).groupby(periods).sum()
+        return sales[sales.index < current]
+
+    key = (frame_version(df), date_column, freq, current)
+    return closed_sales_cache.get_or_compute(key, compute)
+
+
+# row order of df sorted by one column, missing values last
+def sort_order(df, column, descending=False):
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # categories are sorted, so their codes sort like the values
+        key = values.cat.codes.to_numpy().astype("float64")
+        key[key < 0] = np.nan
+    elif pd.api.types.is_datetime64_any_dtype(values):
+        key = values.to_numpy(dtype="datetime64[ns]").view("int64").astype("float64")
+        key[values.isna().to_numpy()] = np.nan
+    else:
+        key = values.to_numpy(dtype="float64", na_value=np.nan)
+    if descending:
+        key = -key
+    return np.argsort(key, kind="stable")
@@ -0,0 +1,165 @@
+# import libraries
+import itertools
+import sys
+import threading
+import time
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+
+# index for the Current Listings filter (zip code, max price, min bed / bath).
+# listings are grouped by zip code and sorted by price within each zip, so
+# "price <= x" is a searchsorted prefix per selected zip and only that prefix
+# is checked for bedrooms and bathrooms
+
+# every index gets a new version number, so cached filter results of an older
+# frame are never returned for a newer one
+_versions = itertools.count(1)
+
+
+class ListingsIndex:
+    def __init__(self, df):
+        self.version = next(_versions)
+        # sort on integer codes, not on the zip code strings
+        zip_codes = df["zip_code"].astype("category")
+        codes = zip_codes.cat.codes.to_numpy()
+        labels = zip_codes.cat.categories.astype(str)
+        price = df["price"].to_numpy(dtype="float64", na_value=np.nan)
+        # missing bed / bath never pass a ">= n" filter, as with the masks
+        bed = df["bed"].to_numpy(dtype="int16", na_value=-1)
+        bath = df["bath"].to_numpy(dtype="int16", na_value=-1)
+
+        # sort by zip code, then price (NaN prices end up last in each zip)
+        order = np.lexsort((price, codes))
+        self.positions = order
+        self.price = price[order]
+        self.bed = bed[order]
+        self.bath = bath[order]
+
+        found, starts = np.unique(codes[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        self.zips = {
+            labels[c]: (s, e) for c, s, e in zip(found, starts, ends) if c >= 0
+        }
+
+    # row positions of the matching listings, ordered by price (equal prices in
+    # frame order, like the database's "price, rowid") when sort=True and by
+    # their position in the frame otherwise
+    def query(self, price, bed, bath, zip_selected, sort=False):
+        parts = []
+        for z in zip_selected:
+            bounds = self.zips.get(str(z))
+            if bounds is None:
+                continue
+            start, end = bounds
+            stop = start + np.searchsorted(
+                self.price[start:end], price, side="right"
+            )
+            keep = (self.bed[start:stop] >= bed) & (self.bath[start:stop] >= bath)
+            parts.append(np.flatnonzero(keep) + start)
+
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        found = np.concatenate(parts)
+        positions = self.positions[found]
+        if sort:
+            return positions[np.lexsort((positions, self.price[found]))]
+        return np.sort(positions)
+
+
+# one index per listings frame, rebuilt only when the frame is replaced. the
+# lock guards the dict against the callback threads and the KPI engine
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+
+
+def listings_index(df):
+    with _index_cache_lock:
+        cached = _index_cache.get(id(df))
+    if cached is not None and cached[0]() is df:
+        return cached[1]
+
+    index = ListingsIndex(df)
+    with _index_cache_lock:
+        for k in [k for k, v in _index_cache.items() if v[0]() is None]:
+            del _index_cache[k]
+        _index_cache[id(df)] = (weakref.ref(df), index)
+    return index
+
+
+# filter results shared by the Current Listings chart and table callbacks,
+# which receive the same inputs: the filter and the price sort run once per
+# interaction and the second callback is a cache hit
+filter_cache = LRUCache(maxsize=256, name="filter")
+
+
+# row positions of the listings passing the filter, in price order when
+# sort=True and in frame order otherwise
+def filter_positions(df, price, bed, bath, zip_selected, sort=False):
+    index = listings_index(df)
+    key = (index.version, price, bed, bath, tuple(sorted(map(str, zip_selected))))
+    # positions are cached ordered by price, frame order is a cheap sort away
+    positions = filter_cache.get_or_compute(
+        key, lambda: index.query(price, bed, bath, zip_selected, sort=True)
+    )
+    return positions if sort else np.sort(positions)
+
+
+def filter_listings(df, price, bed, bath, zip_selected, sort=False):
+    return df.iloc[filter_positions(df, price, bed, bath, zip_selected, sort)]
+
+
+# the boolean mask filter the index replaces, kept for the benchmark
+def filter_listings_mask(df, price, bed, bath, zip_selected):
+    return df[
+        (df["zip_code"].isin(zip_selected))
+        & (df["price"] <= price)
+        & (df["bed"] >= bed)
+        & (df["bath"] >= bath)
+    ]
+
+
+# micro-benchmark: python listings_index.py [rows]
+def benchmark(rows=1_000_000, repeat=50, seed=0):
+    rng = np.random.default_rng(seed)
+    zips = [str(z) for z in range(75000, 75000 + 1000)]
+    df = pd.DataFrame(
+        {
+            "zip_code": pd.Categorical(rng.choice(zips, rows)),
+            "price": rng.integers(50, 5000, rows).astype("float32") * 1000,
+            "bed": pd.array(rng.integers(0, 7, rows), dtype="Int16"),
+            "bath": pd.array(rng.integers(0, 5, rows), dtype="Int16"),
+        }
+    )
+    selected = zips[:11]
+
+    start = time.perf_counter()
+    index = listings_index(df)
+    build = time.perf_counter() - start
+    print(f"{rows:,} listings, index built in {build * 1000:.1f} ms")
+
+    for price in [100_000, 500_000, 4_000_000]:
+        timings = {}
+        for name, func in [
+            ("mask", lambda: filter_listings_mask(df, price, 2, 1, selected)),
+            # uncached, filter_listings would answer repeats from filter_cache
+            ("index", lambda: df.iloc[index.query(price, 2, 1, selected)]),
+        ]:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = func()
+            timings[name] = (time.perf_counter() - start) / repeat
+        print(
+            f"price <= {price:>9,}: {len(result):>6,} rows, "
+            f"mask {timings['mask'] * 1000:7.2f} ms, "
+            f"index {timings['index'] * 1000:7.2f} ms "
+            f"({timings['mask'] / timings['index']:.0f}x)"
+        )
+    return index
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,224 @@
+# import libraries
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+
+from dash.exceptions import PreventUpdate
+
+import cache
+import startup
+
+# per-callback latency, response size, errors and cache hits, served in the
+# prometheus text format at /metrics. recording a call is a couple of clock
+# reads, a bisect and a locked counter update, cheap enough to stay on.
+# every server process (gunicorn worker) counts its own requests
+#
+# set SLOW_CALLBACK_MS to print every callback slower than that, with its
+# input arguments
+
+SLOW_CALLBACK_MS = float(os.environ.get("SLOW_CALLBACK_MS", 0))
+
+latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+size_buckets = [1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7]
+
+# the callback running in this thread, for the cache lookup counts
+current_callback = contextvars.ContextVar("current_callback", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class CallbackMetrics:
+    def __init__(self):
+        self.latency = defaultdict(lambda: Histogram(latency_buckets))
+        self.size = defaultdict(lambda: Histogram(size_buckets))
+        self.errors = defaultdict(int)
+        self.prevented = defaultdict(int)
+        self.lookups = defaultdict(int)  # (callback, cache, hit) -> count
+        self.caches = []
+        self.gauges = {}  # name -> function returning the value
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, size=None, error=False):
+        with self._lock:
+            self.latency[name].observe(seconds)
+            if size is not None:
+                self.size[name].observe(size)
+            elif error:
+                self.errors[name] += 1
+            else:
+                self.prevented[name] += 1
+
+    def count_lookup(self, lru, hit):
+        key = (current_callback.get(), lru.name, hit)
+        with self._lock:
+            self.lookups[key] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP market_monitor_callback_seconds Callback latency.",
+                "# TYPE market_monitor_callback_seconds histogram",
+            ]
+            for name, histogram in sorted(self.latency.items()):
+                lines += histogram.lines(
+                    "market_monitor_callback_seconds", f'callback="{name}"'
+                )
+            lines += [
+                "# HELP market_monitor_callback_response_bytes Serialised "
+                "callback response size.",
+                "# TYPE market_monitor_callback_response_bytes histogram",
+            ]
+            for name, histogram in sorted(self.size.items()):
+                lines += histogram.lines(
+                    "market_monitor_callback_response_bytes", f'callback="{name}"'
+                )
+            lines += [
+                "# HELP market_monitor_callback_errors_total Callbacks that raised.",
+                "# TYPE market_monitor_callback_errors_total counter",
+            ]
+            lines += [
+                f'market_monitor_callback_errors_total{{callback="{name}"}} {count}'
+                for name, count in sorted(self.errors.items())
+            ]
+            lines += [
+                "# HELP market_monitor_callback_prevented_total Callbacks that "
+                "sent no update.",
+                "# TYPE market_monitor_callback_prevented_total counter",
+            ]
+            lines += [
+                f'market_monitor_callback_prevented_total{{callback="{name}"}} '
+                f"{count}"
+                for name, count in sorted(self.prevented.items())
+            ]
+            lines += [
+                "# HELP market_monitor_cache_lookups_total Cache lookups per "
+                "callback.",
+                "# TYPE market_monitor_cache_lookups_total counter",
+            ]
+            for (name, cache_name, hit), count in sorted(
+                self.lookups.items(), key=str
+            ):
+                lines.append(
+                    f'market_monitor_cache_lookups_total{{callback="{name or ""}",'
+                    f'cache="{cache_name}",result="{"hit" if hit else "miss"}"}} '
+                    f"{count}"
+                )
+
+        lines += [
+            "# HELP market_monitor_cache_entries Entries held per cache.",
+            "# TYPE market_monitor_cache_entries gauge",
+        ]
+        for lru in self.caches:
+            stats = lru.stats()
+            lines.append(
+                f'market_monitor_cache_entries{{cache="{lru.name}"}} {stats["size"]}'
+            )
+            if "bytes" in stats:
+                lines.append(
+                    f'market_monitor_cache_bytes{{cache="{lru.name}"}} '
+                    f'{stats["bytes"]}'
+                )
+
+        lines += [
+            "# HELP market_monitor_step_seconds Data preparation steps.",
+            "# TYPE market_monitor_step_seconds summary",
+        ]
+        for name, (count, seconds) in sorted(startup.step_totals().items()):
+            labels = f'step="{name}"'
+            lines.append(f"market_monitor_step_seconds_sum{{{labels}}} {seconds}")
+            lines.append(f"market_monitor_step_seconds_count{{{labels}}} {count}")
+
+        for name, value in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = CallbackMetrics()
+
+
+def short_repr(value, limit=200):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + f"... ({len(text)} chars)"
+
+
+def instrument(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        token = current_callback.set(name)
+        start = time.perf_counter()
+        size = error = None
+        try:
+            # dash callbacks return the serialised response
+            result = func(*args, **kwargs)
+            size = len(result)
+            return result
+        except PreventUpdate:
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            current_callback.reset(token)
+            metrics.record(name, seconds, size, error)
+            if SLOW_CALLBACK_MS and seconds * 1000 > SLOW_CALLBACK_MS:
+                print(
+                    f"slow callback {name}: {seconds * 1000:.0f} ms, "
+                    f"args {', '.join(short_repr(a) for a in args)}"
+                )
+
+    return timed
+
+
+# wrap every callback of `app` and serve /metrics. dash only moves the
+# @callback callbacks into app.callback_map before the first request, so
+# they are wrapped right after that
+def install(app, caches=(), gauges=None):
+    metrics.caches = [c for c in caches if c is not None]
+    metrics.gauges.update(gauges or {})
+    cache.on_lookup = metrics.count_lookup
+    installed = []
+
+    @app.server.before_request
+    def wrap_callbacks():
+        if installed:
+            return
+        with metrics._lock:
+            if installed:
+                return
+            for entry in app.callback_map.values():
+                entry["callback"] = instrument(entry["callback"])
+            installed.append(True)
+
+    @app.server.route("/metrics")
+    def metrics_route():
+        return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    return metrics
@@ -1,5 +1,21 @@
+import os
+
 import pandas as pd
 
+from schema import (
+    apply_listing_schema,
+    apply_stats_schema,
+    listing_read_dtypes,
+    stats_read_dtypes,
+)
+from startup import step
+from stats_store import read_stats_store
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
 # choose postal codes that are relevant
 included_postal_codes = [
     77546,
@@ -15,26 +31,126 @@ included_postal_codes = [
     77058,
 ]
 
+# rows per chunk for the streaming ingest
+INGEST_CHUNKSIZE = 200_000
+
+# columns the dashboard actually uses, everything else is dropped while
+# streaming the source files
+listing_columns = [
+    "brokered_by",
+    "status",
+    "price",
+    "bed",
+    "bath",
+    "acre_lot",
+    "street",
+    "city",
+    "zip_code",
+    "house_size",
+    "date_published",
+    "date_sold",
+    "links",
+]
+stats_columns = [
+    "month_date_yyyymm",
+    "postal_code",
+    "zip_name",
+    "median_listing_price",
+    "median_listing_price_mm",
+    "median_listing_price_yy",
+    "total_listing_count",
+    "total_listing_count_mm",
+    "total_listing_count_yy",
+]
+
+
+# peak resident memory of this process in MB, None where it can't be measured
+def peak_memory_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# read a csv in chunks, keeping only the given columns and the rows of the
+# included zip codes, so only the surviving rows are ever held together
+def read_csv_filtered(
+    file, zip_column, included_postal_codes, columns, chunksize, dtype=None
+):
+    scanned = 0
+    kept = []
+    reader = pd.read_csv(
+        file, usecols=lambda c: c in columns, dtype=dtype, chunksize=chunksize
+    )
+    for chunk in reader:
+        scanned += len(chunk)
+        chunk = chunk[chunk[zip_column].isin(included_postal_codes)]
+        if len(chunk):
+            kept.append(chunk)
+
+    if kept:
+        df = pd.concat(kept, ignore_index=True)
+    else:
+        df = pd.read_csv(file, usecols=lambda c: c in columns, dtype=dtype, nrows=0)
+
+    peak = peak_memory_mb()
+    print(
+        f"{file}: scanned {scanned:,} rows, kept {len(df):,} rows"
+        + (f", peak memory {peak:,.1f} MB" if peak is not None else "")
+    )
+    return df
+
 
 def preprocess_listings(
     file="real_estate_broker_data_texas.csv",
     included_postal_codes=included_postal_codes,
+    chunksize=None,
 ):
-    df = pd.read_csv(file)
-    df = df[df["zip_code"].isin(included_postal_codes)]
-    df["zip_code"] = df["zip_code"].astype(int).astype(str)
-    df["date_sold"] = pd.to_datetime(df["date_sold"]).dt.strftime("%Y-%m-%d")
-    df["date_published"] = pd.to_datetime(df["date_published"]).dt.strftime("%Y-%m-%d")
-    return df
+    with step("preprocess_listings"):
+        # streaming ingest when a chunksize is given, otherwise read the whole
+        # file
+        if chunksize:
+            df = read_csv_filtered(
+                file,
+                "zip_code",
+                included_postal_codes,
+                listing_columns,
+                chunksize,
+                listing_read_dtypes,
+            )
+        else:
+            df = pd.read_csv(file, dtype=listing_read_dtypes)
+        return prepare_listings(df, included_postal_codes)
+
+
+# filter listings to the included zip codes and apply the listings schema
+# (zip codes, cities etc. become categoricals, dates real datetimes). shared
+# by preprocess_listings and the ingest of uploaded files
+def prepare_listings(df, included_postal_codes=included_postal_codes):
+    zip_codes = pd.to_numeric(df["zip_code"], errors="coerce")
+    df = df[zip_codes.isin(included_postal_codes)]
+    return apply_listing_schema(df)
 
 
 def preprocess_stats(
-    file="real_estate_stats_texas.csv", included_postal_codes=included_postal_codes
+    file="real_estate_stats_texas.csv",
+    included_postal_codes=included_postal_codes,
+    chunksize=None,
 ):
-    df = pd.read_csv(file)
-    df = df[df["postal_code"].isin(included_postal_codes)]
-    df["postal_code"] = df["postal_code"].astype(str)
-    df.loc[:, "month_date_yyyymm"] = pd.to_datetime(
-        df["month_date_yyyymm"].astype(str), format="%Y%m"
-    )
-    return df
+    with step("preprocess_stats"):
+        # a stats store (see stats_store.py): read the included zips only
+        if os.path.isdir(file):
+            df = read_stats_store(file, included_postal_codes, stats_columns)
+        elif chunksize:
+            df = read_csv_filtered(
+                file,
+                "postal_code",
+                included_postal_codes,
+                stats_columns,
+                chunksize,
+                stats_read_dtypes,
+            )
+        else:
+            df = pd.read_csv(file, dtype=stats_read_dtypes)
+            df = df[df["postal_code"].isin(included_postal_codes)]
+        return apply_stats_schema(df)
@@ -0,0 +1,136 @@
+# import libraries
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# canonical column types of the listings and stats frames. everything that
+# leaves preprocess.py goes through apply_listing_schema / apply_stats_schema,
+# and create_charts.py relies on these types (real datetimes, categoricals)
+
+listing_schema = {
+    "brokered_by": "Int32",
+    "status": "category",
+    "price": "float32",
+    "bed": "Int16",
+    "bath": "Int16",
+    "acre_lot": "float32",
+    "street": "category",
+    "city": "category",
+    "state": "category",
+    "zip_code": "category",
+    "house_size": "float32",
+    "links": "category",
+}
+listing_date_columns = ["date_published", "date_sold", "prev_sold_date"]
+
+stats_schema = {
+    "postal_code": "category",
+    "zip_name": "category",
+    "median_listing_price": "float32",
+    "median_listing_price_mm": "float32",
+    "median_listing_price_yy": "float32",
+    "total_listing_count": "float32",
+    "total_listing_count_mm": "float32",
+    "total_listing_count_yy": "float32",
+}
+stats_date_columns = ["month_date_yyyymm"]
+
+# numeric types that are safe to use while parsing the csv, before the zip
+# filter. categoricals are only applied once the chunks are concatenated,
+# otherwise every chunk would end up with different categories
+listing_read_dtypes = {
+    "price": "float32",
+    "acre_lot": "float32",
+    "house_size": "float32",
+}
+stats_read_dtypes = {
+    "median_listing_price": "float32",
+    "median_listing_price_mm": "float32",
+    "median_listing_price_yy": "float32",
+    "total_listing_count": "float32",
+    "total_listing_count_mm": "float32",
+    "total_listing_count_yy": "float32",
+}
+
+# columns shown in the listings tables
+listing_table_columns = [
+    "zip_code",
+    "city",
+    "street",
+    "price",
+    "house_size",
+    "bed",
+    "bath",
+    "acre_lot",
+]
+numeric_table_columns = ["price", "house_size", "bed", "bath", "acre_lot"]
+
+
+# zip codes are read as numbers (77546.0) and kept as "77546" labels
+def zip_labels(values):
+    return pd.to_numeric(values, errors="coerce").astype("Int64").astype(str)
+
+
+# listing dates are stored as day precision, timezone naive datetimes
+def to_day(values):
+    dates = pd.to_datetime(values, utc=True, errors="coerce")
+    return dates.dt.tz_localize(None).dt.normalize()
+
+
+def apply_listing_schema(df):
+    df = df.copy()
+    if "zip_code" in df:
+        df["zip_code"] = zip_labels(df["zip_code"])
+    for col in listing_date_columns:
+        if col in df:
+            df[col] = to_day(df[col])
+    return df.astype({k: v for k, v in listing_schema.items() if k in df})
+
+
+def apply_stats_schema(df):
+    df = df.copy()
+    if "postal_code" in df:
+        df["postal_code"] = zip_labels(df["postal_code"])
+    if "month_date_yyyymm" in df:
+        df["month_date_yyyymm"] = pd.to_datetime(
+            df["month_date_yyyymm"].astype(int).astype(str), format="%Y%m"
+        )
+    return df.astype({k: v for k, v in stats_schema.items() if k in df})
+
+
+# restore column types lost on a round trip, e.g. parquet reads categoricals
+# of numbers (street ids) back as plain floats
+def conform(df, schema):
+    changed = {k: v for k, v in schema.items() if k in df and str(df[k].dtype) != v}
+    return df.astype(changed) if changed else df
+
+
+# rows for a DataTable. float32 values are widened through their shortest
+# decimal form, so 0.51 is sent as 0.51 and not as 0.5099999904632568
+def to_records(df):
+    df = df.copy()
+    for col in df.columns[df.dtypes == "float32"]:
+        df[col] = df[col].astype(str).astype("float64")
+    return df.to_dict("records")
+
+
+# concatenate listing frames without losing the categoricals: each categorical
+# column gets the (sorted) union of the categories of all frames first
+def concat_frames(frames):
+    frames = list(frames)
+    for col in frames[0].columns:
+        columns = [f[col] for f in frames if col in f]
+        if len(columns) < len(frames) or not all(
+            isinstance(c.dtype, pd.CategoricalDtype) for c in columns
+        ):
+            continue
+        try:
+            categories = union_categoricals(columns, sort_categories=True).categories
+        except TypeError:
+            # e.g. numeric street ids in one frame and street names in another
+            columns = [c.astype(str).astype("category") for c in columns]
+            categories = union_categoricals(columns, sort_categories=True).categories
+        frames = [
+            f.assign(**{col: c.cat.set_categories(categories)})
+            for f, c in zip(frames, columns)
+        ]
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,120 @@
+# import libraries
+import argparse
+import functools
+import gc
+import os
+import signal
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+# production server. the data is loaded and prepared once, in the gunicorn
+# master process (importing app), and the workers are forked from it, so they
+# share the frames copy-on-write instead of each loading its own copy.
+# linux / macos only, use `python app.py` for development
+#
+#   python serve.py --workers 4 --threads 8
+#
+# kill -HUP <master pid> reloads the data in the master and restarts the
+# workers gracefully from it; kill -USR2 starts a new master next to the old one
+#
+# the data is only ever reloaded in the master: the watcher thread (started
+# by app.py) runs there, and a worker merging an upload sends the master a HUP
+# as well. every worker is forked from the one new dataset, which they share
+# again, and sees the upload
+
+
+# runs in the master once it is ready, before the first workers are forked
+def when_ready(server):
+    market_monitor = sys.modules["app"]
+    # source changes (master) and merged uploads (workers) hang up the master
+    market_monitor.dataset.on_change = functools.partial(
+        os.kill, server.pid, signal.SIGHUP
+    )
+
+
+# runs in the master on a HUP, before the new workers are forked. the arbiter
+# waits meanwhile, the old workers serve the previous data until replaced
+def on_reload(server):
+    market_monitor = sys.modules["app"]
+    gc.unfreeze()
+    try:
+        market_monitor.dataset.reload().warming.join()
+    except Exception as e:
+        # the new workers get the previous version
+        print(e)
+    gc.collect()
+    gc.freeze()
+
+
+# runs in every worker right after the fork
+def post_fork(server, worker):
+    market_monitor = sys.modules["app"]
+    # threads are not inherited, each worker refreshes its own KPI snapshots.
+    # the master runs no thread that takes the cache or metrics locks (a fork
+    # while one is held would leave the worker's copy locked forever). the
+    # source files are watched by the master only, without those locks
+    market_monitor.kpi_engine.start()
+    # the disk cache's sqlite connection must not be shared across processes
+    market_monitor.background_callback_manager.handle.close()
+
+
+class MarketMonitorServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+        self.cfg.set("when_ready", when_ready)
+        self.cfg.set("on_reload", on_reload)
+        self.cfg.set("post_fork", post_fork)
+
+    def load(self):
+        import app as market_monitor
+
+        # fitted once here, the workers share the trendlines
+        market_monitor.dataset.current.warming.join()
+        # the loaded objects are never collected, and freezing them keeps the
+        # workers' garbage collector from writing to (and so copying) their
+        # memory pages
+        gc.freeze()
+        return market_monitor.app.server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Market Monitor with gunicorn.")
+    parser.add_argument("--bind", default=os.environ.get("BIND", "127.0.0.1:8050"))
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WORKERS", os.cpu_count() or 1)),
+        help="worker processes, defaults to the number of cores",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.environ.get("THREADS", 4)),
+        help="request threads per worker",
+    )
+    parser.add_argument("--timeout", type=int, default=120)
+    parser.add_argument("--pid", default=None, help="write the master pid here")
+    args = parser.parse_args()
+
+    MarketMonitorServer(
+        {
+            "bind": args.bind,
+            "workers": args.workers,
+            "threads": args.threads,
+            "timeout": args.timeout,
+            "graceful_timeout": args.timeout,
+            "pidfile": args.pid,
+            # import app (and load the data) before forking the workers
+            "preload_app": True,
+        }
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
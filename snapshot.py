@@ -0,0 +1,237 @@
+# import libraries
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from listings_db import ListingsDB, is_listings_db
+from schema import conform, listing_schema, stats_schema
+from preprocess import (
+    INGEST_CHUNKSIZE,
+    included_postal_codes,
+    preprocess_listings,
+    preprocess_stats,
+)
+
+# columnar snapshots of the preprocessed frames, so the app does not have to
+# re-parse the source csv files on every start
+
+# bump this whenever preprocess.py changes the shape or dtypes of its output,
+# so snapshots written by older code are rebuilt instead of loaded
+SNAPSHOT_VERSION = 2
+SNAPSHOT_DIR = "snapshots"
+
+# a csv file or a listings database (see listings_db.py)
+LISTINGS_FILE = os.environ.get("LISTINGS_FILE", "real_estate_broker_data_texas.csv")
+# a csv file or a stats store directory (see stats_store.py)
+STATS_FILE = os.environ.get("STATS_FILE", "real_estate_stats_texas.csv")
+
+
+# parquet needs pyarrow, without it we simply fall back to parsing the csv
+def snapshots_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# hash the source file in blocks so large files never sit in memory at once
+def file_digest(file, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def zips_digest(zips):
+    key = ",".join(str(z) for z in sorted(int(z) for z in zips))
+    return hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+def snapshot_paths(file, zips, snapshot_dir=SNAPSHOT_DIR):
+    name = f"{Path(file).stem}.{zips_digest(zips)}"
+    return (
+        Path(snapshot_dir) / f"{name}.parquet",
+        Path(snapshot_dir) / f"{name}.json",
+    )
+
+
+def read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# a snapshot is valid when it was written by the same snapshot version for the
+# same zip codes and the source file is unchanged. size and mtime are checked
+# first, the content hash is only computed when the mtime moved (e.g. the file
+# was copied again without changes)
+def snapshot_is_valid(file, zips, meta, data_path, pruned=False):
+    if meta is None or not data_path.exists():
+        return False
+    if meta.get("version") != SNAPSHOT_VERSION:
+        return False
+    # the streaming ingest keeps fewer columns than the full read
+    if meta.get("pruned", False) != pruned:
+        return False
+    if meta.get("zips") != sorted(int(z) for z in zips):
+        return False
+
+    stat = os.stat(file)
+    if stat.st_size != meta.get("size"):
+        return False
+    if stat.st_mtime_ns == meta.get("mtime_ns"):
+        return True
+    return file_digest(file) == meta.get("sha256")
+
+
+def write_snapshot(df, file, zips, snapshot_dir=SNAPSHOT_DIR, pruned=False):
+    data_path, meta_path = snapshot_paths(file, zips, snapshot_dir)
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+
+    stat = os.stat(file)
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "source": str(file),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": file_digest(file),
+        "zips": sorted(int(z) for z in zips),
+        "pruned": pruned,
+        "rows": len(df),
+    }
+
+    # write to temporary files and rename, so a crashed build or a second
+    # process never sees a half written snapshot
+    tmp_data = data_path.with_suffix(".parquet.tmp")
+    tmp_meta = meta_path.with_suffix(".json.tmp")
+    df.to_parquet(tmp_data, engine="pyarrow")
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_data, data_path)
+    os.replace(tmp_meta, meta_path)
+    return data_path
+
+
+def load_snapshot(
+    preprocess,
+    file,
+    zips,
+    snapshot_dir=SNAPSHOT_DIR,
+    rebuild=False,
+    chunksize=None,
+    schema=None,
+):
+    # a stats store is columnar already and read per zip code
+    if not snapshots_available() or os.path.isdir(file):
+        return preprocess(file, zips, chunksize=chunksize)
+
+    pruned = bool(chunksize)
+    data_path, meta_path = snapshot_paths(file, zips, snapshot_dir)
+    meta = read_meta(meta_path)
+    if not rebuild and snapshot_is_valid(file, zips, meta, data_path, pruned):
+        # refresh the stored mtime after a successful hash match, so the next
+        # start takes the cheap path again
+        mtime_ns = os.stat(file).st_mtime_ns
+        if meta["mtime_ns"] != mtime_ns:
+            meta["mtime_ns"] = mtime_ns
+            with open(meta_path, "w") as f:
+                json.dump(meta, f, indent=2)
+        df = pd.read_parquet(data_path, engine="pyarrow")
+        return conform(df, schema) if schema else df
+
+    df = preprocess(file, zips, chunksize=chunksize)
+    write_snapshot(df, file, zips, snapshot_dir, pruned)
+    return df
+
+
+# drop-in replacements for preprocess_listings / preprocess_stats
+def load_listings(
+    file=LISTINGS_FILE,
+    included_postal_codes=included_postal_codes,
+    snapshot_dir=SNAPSHOT_DIR,
+    rebuild=False,
+    chunksize=None,
+):
+    # a listings database is queried, not loaded
+    if is_listings_db(file):
+        return ListingsDB(file)
+    return load_snapshot(
+        preprocess_listings,
+        file,
+        included_postal_codes,
+        snapshot_dir,
+        rebuild,
+        chunksize,
+        listing_schema,
+    )
+
+
+def load_stats(
+    file=STATS_FILE,
+    included_postal_codes=included_postal_codes,
+    snapshot_dir=SNAPSHOT_DIR,
+    rebuild=False,
+    chunksize=None,
+):
+    return load_snapshot(
+        preprocess_stats,
+        file,
+        included_postal_codes,
+        snapshot_dir,
+        rebuild,
+        chunksize,
+        stats_schema,
+    )
+
+
+# command line: python snapshot.py [--force] [--chunksize N] [--listings FILE] ...
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the columnar snapshots of the preprocessed data."
+    )
+    parser.add_argument("--listings", default=LISTINGS_FILE)
+    parser.add_argument("--stats", default=STATS_FILE)
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild even if the existing snapshots are still valid",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=INGEST_CHUNKSIZE,
+        help="rows per chunk for the streaming ingest, 0 reads the whole file",
+    )
+    args = parser.parse_args(argv)
+
+    if not snapshots_available():
+        parser.error("pyarrow is required to write snapshots")
+
+    for label, loader, file in [
+        ("listings", load_listings, args.listings),
+        ("stats", load_stats, args.stats),
+    ]:
+        start = time.perf_counter()
+        df = loader(
+            file,
+            snapshot_dir=args.snapshot_dir,
+            rebuild=args.force,
+            chunksize=args.chunksize or None,
+        )
+        elapsed = time.perf_counter() - start
+        data_path, _ = snapshot_paths(file, included_postal_codes, args.snapshot_dir)
+        print(f"{label}: {len(df)} rows -> {data_path} ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# import libraries
+import builtins
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# cold start accounting. every data preparation step runs inside step() (the
+# totals are also served at /metrics), and with --profile-startup the imports
+# made by the app's own modules are timed too:
+#
+#   python app.py --profile-startup
+#
+# prints the breakdown and writes it to startup_profile.json (or the path in
+# STARTUP_PROFILE) instead of starting the server, so cold start regressions
+# can be compared between versions
+
+PROFILE = "--profile-startup" in sys.argv
+PROFILE_FILE = os.environ.get("STARTUP_PROFILE", "startup_profile.json")
+
+_started = time.perf_counter()
+_project_dir = os.path.dirname(os.path.abspath(__file__))
+_lock = threading.Lock()
+
+_ready = None
+steps = deque(maxlen=1000)  # [{"step", "seconds", "thread"}], the latest
+imports = []  # [{"module", "seconds", "imported_by", "depth"}]
+
+
+@contextmanager
+def step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            steps.append(
+                {
+                    "step": name,
+                    "seconds": round(seconds, 4),
+                    "thread": threading.current_thread().name,
+                }
+            )
+
+
+# step name -> (times run, total seconds)
+def step_totals():
+    totals = {}
+    with _lock:
+        for entry in steps:
+            count, seconds = totals.get(entry["step"], (0, 0.0))
+            totals[entry["step"]] = (count + 1, seconds + entry["seconds"])
+    return totals
+
+
+# times every module import made from a file of this project, including the
+# modules that import pulls in (so plotly.express includes pandas if it was
+# not loaded yet). depth > 0 are imports made while importing another
+# project module, already counted in that module's time
+_import = builtins.__import__
+_depth = threading.local()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    importer = (globals or {}).get("__file__") or ""
+    if (
+        level
+        or name in sys.modules
+        or os.path.dirname(os.path.abspath(importer)) != _project_dir
+    ):
+        return _import(name, globals, locals, fromlist, level)
+    depth = getattr(_depth, "value", 0)
+    _depth.value = depth + 1
+    start = time.perf_counter()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        seconds = time.perf_counter() - start
+        _depth.value = depth
+        with _lock:
+            imports.append(
+                {
+                    "module": name,
+                    "seconds": round(seconds, 4),
+                    "imported_by": os.path.basename(importer),
+                    "depth": depth,
+                }
+            )
+
+
+if PROFILE:
+    builtins.__import__ = _timed_import
+
+
+# the app could start serving now, background steps may still be running
+def ready():
+    global _ready
+    _ready = time.perf_counter() - _started
+
+
+def profile():
+    total = time.perf_counter() - _started
+    with _lock:
+        return {
+            "ready_seconds": round(_ready if _ready is not None else total, 4),
+            "total_seconds": round(total, 4),
+            "import_seconds": round(
+                sum(i["seconds"] for i in imports if i["depth"] == 0), 4
+            ),
+            "imports": list(imports),
+            "steps": list(steps),
+        }
+
+
+def write_profile(path=PROFILE_FILE):
+    report = profile()
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"ready after {report['ready_seconds']:.2f}s "
+        f"({report['total_seconds']:.2f}s with background steps), "
+        f"written to {path}"
+    )
+    for entry in report["steps"]:
+        print(f"  {entry['step']:<29} {entry['seconds']:8.3f}s")
+    slowest = sorted(report["imports"], key=lambda i: -i["seconds"])
+    for entry in slowest[:15]:
+        print(f"  import {entry['module']:<22} {entry['seconds']:8.3f}s")
+    return report
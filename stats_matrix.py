@@ -0,0 +1,73 @@
+# import libraries
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, frame_version
+
+# the stats time series as dense month x zip code matrices, one per metric,
+# built once per stats frame. a chart of some zip codes gathers their columns
+# from the matrices instead of filtering and regrouping the long frame
+
+stats_metrics = [
+    "median_listing_price",
+    "median_listing_price_mm",
+    "median_listing_price_yy",
+    "total_listing_count",
+    "total_listing_count_mm",
+    "total_listing_count_yy",
+]
+
+
+class StatsMatrix:
+    def __init__(self, df):
+        months = df["month_date_yyyymm"].to_numpy(dtype="datetime64[ns]")
+        codes, zips = pd.factorize(df["postal_code"].astype(str), sort=True)
+        self.months = np.unique(months)
+        self.zips = np.asarray(zips)
+        self.column = {z: j for j, z in enumerate(self.zips)}
+        # the city (zip_name) of every zip code, from its first row
+        _, self.first_row = np.unique(codes, return_index=True)
+        self.cities = df["zip_name"].astype(str).to_numpy()[self.first_row]
+
+        # month x zip, NaN where a zip code has no row for a month
+        rows = np.searchsorted(self.months, months)
+        self.values = {}
+        for metric in stats_metrics:
+            if metric not in df:
+                continue
+            matrix = np.full((len(self.months), len(self.zips)), np.nan)
+            matrix[rows, codes] = df[metric].to_numpy(dtype="float64", na_value=np.nan)
+            self.values[metric] = matrix
+
+    # matrix columns of the selected zip codes, unknown ones are left out
+    def columns(self, zip_selected):
+        found = [self.column.get(str(z)) for z in zip_selected]
+        return np.sort(np.array([c for c in found if c is not None], dtype=np.intp))
+
+    # one series per city of the selected zip codes (a city can span several
+    # of them): (city, its zip codes, dates, values of each metric), without
+    # the missing months. cities come in the order of their first row in the
+    # frame, as the traces of px.scatter(color="zip_name") do
+    def series(self, zip_selected, metrics):
+        columns = self.columns(zip_selected)
+        by_row = columns[np.argsort(self.first_row[columns])]
+        cities, first = np.unique(self.cities[by_row], return_index=True)
+        for city in cities[np.argsort(first)]:
+            cols = columns[self.cities[columns] == city]
+            dates = np.tile(self.months, len(cols))
+            values = [self.values[m][:, cols].T.ravel() for m in metrics]
+            keep = ~np.isnan(values[0])
+            yield (
+                city,
+                self.zips[cols].tolist(),
+                dates[keep],
+                [v[keep] for v in values],
+            )
+
+
+# one matrix set per stats frame, rebuilt only when the frame is replaced
+matrix_cache = LRUCache(maxsize=2, name="stats_matrix")
+
+
+def stats_matrix(df):
+    return matrix_cache.get_or_compute(frame_version(df), lambda: StatsMatrix(df))
@@ -0,0 +1,148 @@
+# import libraries
+import argparse
+import glob
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+# the realtor.com (RDC) zip code history as a parquet file per state and zip
+# code, <store>/<state>/<zip>.parquet, each sorted by month. the build streams
+# the nationwide csv once; preprocess_stats reads only the files of the
+# included zip codes, so more zips or states cost reads in proportion to the
+# zips shown, not to the size of the history
+#
+#   python stats_store.py RDC_Inventory_Core_Metrics_Zip_History.csv --states tx
+#
+# point the app at the store with STATS_FILE=stats_store (see snapshot.py)
+
+RDC_FILE = "RDC_Inventory_Core_Metrics_Zip_History.csv"
+STORE_DIR = "stats_store"
+STATES = ["tx"]
+CHUNKSIZE = 500_000
+
+# one row per zip code and month, the last one in the file wins
+key_columns = ["postal_code", "month_date_yyyymm"]
+
+
+# the state of every row, from the ", tx" at the end of zip_name. the suffix is
+# taken once per distinct name (the categories), not once per row
+def row_states(zip_name):
+    states = zip_name.cat.categories.str[-2:].to_numpy(dtype=object)
+    codes = zip_name.cat.codes.to_numpy()
+    return np.where(codes >= 0, states[codes], None)
+
+
+def read_rdc(file, states, chunksize=CHUNKSIZE):
+    scanned = 0
+    kept = []
+    reader = pd.read_csv(
+        file,
+        # the index column of csv files written by pandas
+        usecols=lambda c: not c.startswith("Unnamed"),
+        # the keys as text, the note at the end of the file is not a number
+        dtype={"zip_name": "category", "postal_code": str, "month_date_yyyymm": str},
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        scanned += len(chunk)
+        state = row_states(chunk["zip_name"])
+        month = pd.to_numeric(chunk["month_date_yyyymm"], errors="coerce")
+        postal_code = pd.to_numeric(chunk["postal_code"], errors="coerce")
+        keep = np.isin(state, states) & month.notna() & postal_code.notna()
+        chunk = chunk[keep].assign(
+            state=state[keep],
+            month_date_yyyymm=month[keep].astype("int64"),
+            postal_code=postal_code[keep].astype("int64"),
+        )
+        if len(chunk):
+            kept.append(chunk.drop_duplicates(key_columns, keep="last"))
+
+    if not kept:
+        return pd.DataFrame(columns=["state"] + key_columns)
+    df = pd.concat(kept, ignore_index=True)
+    # zip_name has different categories in every chunk
+    df["zip_name"] = df["zip_name"].astype(str)
+    df = df.drop_duplicates(key_columns, keep="last")
+    print(f"{file}: scanned {scanned:,} rows, kept {len(df):,} rows")
+    return df
+
+
+def partition_path(store, state, postal_code):
+    return os.path.join(store, state, f"{int(postal_code)}.parquet")
+
+
+# build the store next to the old one and swap it in when complete, so the app
+# never reads a half written store
+def build_stats_store(
+    file=RDC_FILE, store=STORE_DIR, states=STATES, chunksize=CHUNKSIZE
+):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = read_rdc(file, [s.lower() for s in states], chunksize)
+    tmp = store + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    df = df.sort_values(["state", "postal_code", "month_date_yyyymm"])
+    # every file with the same schema, so they can be read as one table (a
+    # column that is empty in one zip code is not written as a null column)
+    schema = pa.Schema.from_pandas(df.drop(columns="state"), preserve_index=False)
+    partitions = 0
+    groups = df.groupby(["state", "postal_code"], sort=False)
+    for (state, postal_code), part in groups:
+        path = partition_path(tmp, state, postal_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(
+            part.drop(columns="state"), schema=schema, preserve_index=False
+        )
+        pq.write_table(table, path)
+        partitions += 1
+
+    old = store + ".old"
+    if os.path.exists(store):
+        os.replace(store, old)
+    os.replace(tmp, store)
+    shutil.rmtree(old, ignore_errors=True)
+    print(f"{partitions:,} zip codes, {len(df):,} rows written to {store}")
+    return partitions
+
+
+# the partition files of `zips`, whatever state they are in
+def partition_files(store, zips):
+    files = []
+    for postal_code in zips:
+        files += glob.glob(partition_path(store, "*", postal_code))
+    return files
+
+
+# the rows of `zips` (pyarrow is only needed, and imported, with a store)
+def read_stats_store(store, zips, columns=None):
+    import pyarrow.parquet as pq
+
+    files = partition_files(store, zips)
+    if not files:
+        return pd.DataFrame(columns=columns)
+    return pq.read_table(files, columns=columns).to_pandas()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the stats store.")
+    parser.add_argument("file", nargs="?", default=RDC_FILE)
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument(
+        "--states", nargs="+", default=STATES, help="state codes, e.g. tx ok la"
+    )
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    build_stats_store(args.file, args.store, args.states, args.chunksize)
+    print(f"built in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# import libraries
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from preprocess import included_postal_codes
+
+# seeded synthetic listings and stats files in the format of the realtor data
+# (see data_cleaning/), for benchmarks and for trying the app without the
+# private csv files. the same seed, size and --today give the same files
+#
+#   python synthetic.py --size 1m --out bench_data/1m
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+SEED = 0
+# rows are drawn and written in blocks of this many, each block with its own
+# seeded generator, so memory stays flat and the output does not depend on
+# how much fits in memory
+BLOCK_ROWS = 500_000
+
+# cities of the zip codes the dashboard shows. listings in other zip codes,
+# which preprocess filters out, are all in Dallas
+zip_cities = {
+    77546: "Friendswood",
+    77573: "League City",
+    77574: "League City",
+    77581: "Pearland",
+    77089: "Houston",
+    77598: "Webster",
+    77539: "Dickinson",
+    77517: "Santa Fe",
+    77511: "Alvin",
+    77062: "Houston",
+    77058: "Houston",
+}
+other_zips = np.arange(75001, 76001)
+included_share = 0.3  # share of listings in the included zip codes
+
+# brokerages, drawn zipf-like so that a few of them hold most listings
+broker_count = 2000
+broker_ids = np.random.default_rng(SEED).choice(
+    np.arange(1, 120_000), broker_count, replace=False
+)
+broker_ids[0] = 53016
+
+links_list = [
+    "https://www.zillow.com/homedetails/2902-Meridian-Bay-Ln-Dickinson-TX-77539/71472548_zpid/",
+    "https://www.zillow.com/homedetails/3015-Misty-Isle-Ct-Dickinson-TX-77539/59823326_zpid/",
+    "https://www.zillow.com/homedetails/203-Armand-Bay-Dr-Dickinson-TX-77539/50447427_zpid/",
+    "https://www.zillow.com/homedetails/201-Creekside-Dr-League-City-TX-77573/27647595_zpid/",
+    "https://www.zillow.com/homedetails/4508-Brookstone-Ln-League-City-TX-77573/50445179_zpid/",
+]
+
+
+def size_rows(size):
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def city_of(zip_code):
+    return pd.Series(zip_code).map(zip_cities).fillna("Dallas").to_numpy()
+
+
+# one block of listings, drawn with numpy generators seeded by (seed, block)
+def listings_block(rows, seed, block, today):
+    rng = np.random.default_rng([seed, block])
+    zips = np.array(included_postal_codes)
+    zip_code = np.where(
+        rng.random(rows) < included_share,
+        zips[rng.integers(0, len(zips), rows)],
+        other_zips[rng.integers(0, len(other_zips), rows)],
+    )
+    status = np.where(rng.random(rows) < 0.55, "for_sale", "sold")
+    # zipf-like: a few brokerages have most of the listings
+    broker = broker_ids[np.minimum(rng.zipf(1.3, rows) - 1, broker_count - 1)]
+
+    # date_published in the last 400 days, date_sold 0-60 days later for sold
+    # listings (the recipe of clean_stats_data.ipynb, vectorised). sold
+    # listings are published 60 days ago at the latest, so no sale is after
+    # today
+    is_sold = status == "sold"
+    age = rng.integers(np.where(is_sold, 60, 0), 400)
+    published = today - pd.to_timedelta(age, unit="D")
+    sold = published + pd.to_timedelta(rng.integers(0, 61, rows), unit="D")
+    sold = sold.where(is_sold)
+
+    return pd.DataFrame(
+        {
+            "brokered_by": broker.astype("float64"),
+            "status": status,
+            "price": np.round(rng.lognormal(12.8, 0.6, rows), -3),
+            "bed": rng.integers(1, 7, rows).astype("float64"),
+            "bath": rng.integers(1, 5, rows).astype("float64"),
+            "acre_lot": np.round(rng.exponential(0.3, rows), 2),
+            "street": rng.integers(1, 2_000_000, rows).astype("float64"),
+            "city": city_of(zip_code),
+            "state": "Texas",
+            "zip_code": zip_code.astype("float64"),
+            "house_size": np.round(rng.normal(2200, 700, rows).clip(400, 19000)),
+            "prev_sold_date": None,
+            "date_published": published.tz_localize("UTC"),
+            "date_sold": sold.tz_localize("UTC"),
+            "links": np.array(links_list)[rng.integers(0, len(links_list), rows)],
+        }
+    )
+
+
+def write_listings(path, rows, seed=SEED, today=None):
+    # dates relative to a fixed day keep the files reproducible, the default
+    # (today) keeps the dashboard's "this month" figures populated
+    today = pd.Timestamp.now().normalize() if today is None else today
+    offset = 0
+    for block, start in enumerate(range(0, rows, BLOCK_ROWS)):
+        df = listings_block(min(BLOCK_ROWS, rows - start), seed, block, today)
+        df.index += offset
+        offset += len(df)
+        df.to_csv(path, mode="w" if block == 0 else "a", header=block == 0)
+
+
+# monthly stats of `zips`, drawn with a generator seeded by (seed, block)
+def stats_block(zips, months, seed, block):
+    rng = np.random.default_rng([seed, 1_000_000 + block])
+    n = len(zips) * len(months)
+    postal_code = np.repeat(zips, len(months))
+    city = np.char.lower(city_of(postal_code).astype(str))
+    # a random walk per zip for the price level
+    price = 300_000 * np.exp(
+        np.cumsum(rng.normal(0.004, 0.02, (len(zips), len(months))), axis=1)
+    ).ravel()
+    return pd.DataFrame(
+        {
+            "month_date_yyyymm": np.tile(
+                months.strftime("%Y%m").astype(int), len(zips)
+            ),
+            "postal_code": postal_code,
+            "zip_name": np.char.add(city, ", tx"),
+            "median_listing_price": np.round(price, -2),
+            "median_listing_price_mm": rng.normal(0, 0.02, n),
+            "median_listing_price_yy": rng.normal(0, 0.05, n),
+            "total_listing_count": rng.integers(10, 300, n).astype("float64"),
+            "total_listing_count_mm": rng.normal(0, 0.1, n),
+            "total_listing_count_yy": rng.normal(0, 0.1, n),
+            "quality_flag": 0,
+        }
+    )
+
+
+# monthly zip stats since 2016-07, as many zips as needed for about `rows` rows
+def write_stats(path, rows, seed=SEED, today=None):
+    today = pd.Timestamp.now().normalize() if today is None else today
+    months = pd.date_range("2016-07-01", today, freq="MS")
+    # the included zip codes first, then made up ones
+    extra = max(rows // len(months) - len(included_postal_codes), 0)
+    zips = np.concatenate([included_postal_codes, np.arange(extra) + 10_000])
+
+    block_zips = max(BLOCK_ROWS // len(months), 1)
+    offset = 0
+    for block, start in enumerate(range(0, len(zips), block_zips)):
+        df = stats_block(zips[start : start + block_zips], months, seed, block)
+        df.index += offset
+        offset += len(df)
+        df.to_csv(path, mode="w" if block == 0 else "a", header=block == 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic data files.")
+    parser.add_argument("--size", default="10k", help="10k, 1m, 10m or a row count")
+    parser.add_argument("--out", default=".", help="directory for the csv files")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument(
+        "--today", default=None, help="date the data ends on, defaults to today"
+    )
+    args = parser.parse_args(argv)
+
+    rows = size_rows(args.size)
+    today = None if args.today is None else pd.Timestamp(args.today)
+    os.makedirs(args.out, exist_ok=True)
+    listings_file = os.path.join(args.out, "real_estate_broker_data_texas.csv")
+    stats_file = os.path.join(args.out, "real_estate_stats_texas.csv")
+    write_listings(listings_file, rows, args.seed, today)
+    write_stats(stats_file, rows, args.seed, today)
+    print(f"{rows:,} rows written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# import libraries
+import os
+import sys
+
+# the app's modules sit at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
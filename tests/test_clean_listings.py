@@ -0,0 +1,48 @@
+# import libraries
+import numpy as np
+import pandas as pd
+
+from data_cleaning.clean_listings import clean_listings
+from synthetic import listings_block
+
+realtor_columns = [
+    "brokered_by",
+    "status",
+    "price",
+    "bed",
+    "bath",
+    "acre_lot",
+    "street",
+    "city",
+    "state",
+    "zip_code",
+    "house_size",
+    "prev_sold_date",
+]
+
+
+# a small realtor-data.csv, with listings of other states and without a price
+# for the cleaning to drop
+def write_realtor_data(path, rows):
+    df = listings_block(rows, 0, 0, pd.Timestamp("2026-06-30"))[realtor_columns]
+    df.loc[df.index % 3 == 1, "state"] = "Louisiana"
+    df.loc[df.index % 7 == 2, "price"] = np.nan
+    df.to_csv(path, index=False)
+
+
+def test_output_does_not_depend_on_workers(tmp_path):
+    file = tmp_path / "realtor-data.csv"
+    write_realtor_data(file, 3000)
+    outputs = {}
+    for workers in [1, 3]:
+        out = tmp_path / f"texas-{workers}.csv"
+        # many small blocks, most of them cut in the middle of a line
+        kept = clean_listings(str(file), str(out), workers=workers, block_bytes=4099)
+        outputs[workers] = out.read_bytes()
+    source = pd.read_csv(file)
+    assert kept == ((source["state"] == "Texas") & source["price"].notna()).sum()
+    assert outputs[1] == outputs[3]
+
+    df = pd.read_csv(tmp_path / "texas-3.csv", index_col=0)
+    assert len(df) == kept
+    assert (df["state"] == "Texas").all() and df["price"].notna().all()
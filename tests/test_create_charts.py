@@ -0,0 +1,26 @@
+# import libraries
+import numpy as np
+import pandas as pd
+
+from create_charts import price_histogram_counts
+
+
+def test_price_histogram_skips_listings_without_city():
+    df = pd.DataFrame(
+        {
+            "price": [100000.0, 250000.0, 400000.0, 300000.0, np.nan],
+            "city": ["Pearland", np.nan, "Houston", "Pearland", "Houston"],
+        }
+    )
+    edges, city_names, counts = price_histogram_counts(df, "price", nbins=4)
+    assert list(city_names) == ["Houston", "Pearland"]
+    assert counts.sum() == 3
+    assert counts.sum(axis=1).tolist() == [1, 2]
+    assert edges[0] == 100000.0 and edges[-1] == 400000.0
+
+
+def test_price_histogram_single_listing_without_city():
+    df = pd.DataFrame({"price": [250000.0], "city": [np.nan]})
+    edges, city_names, counts = price_histogram_counts(df, "price")
+    assert len(city_names) == 0
+    assert counts.shape == (0, 12)
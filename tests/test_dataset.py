@@ -0,0 +1,69 @@
+# import libraries
+import base64
+import os
+
+import pandas as pd
+import pytest
+
+from dataset import DatasetStore, load_dataset, source_state
+from ingest import stage_upload
+from listings_db import build_listings_db
+from synthetic import write_listings, write_stats
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # snapshots and uploads are written relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    write_listings("listings.csv", 2000)
+    write_stats("stats.csv", 500)
+    return DatasetStore("stats.csv", "listings.csv", "uploads/merged")
+
+
+def staged_upload(rows=25):
+    df = pd.read_csv("listings.csv", nrows=rows)
+    contents = base64.b64encode(df.to_csv(index=False).encode()).decode()
+    path, staged_rows = stage_upload(
+        f"data:text/csv;base64,{contents}", "upload.csv", "uploads"
+    )
+    return [{"file": "upload.csv", "path": path, "rows": staged_rows}]
+
+
+def touch(file):
+    stat = os.stat(file)
+    os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_merged_upload_survives_reload(store):
+    loaded = len(store.current.listings)
+    staged = staged_upload()
+    store.merge(staged)
+    merged = len(store.current.listings)
+    assert merged == loaded + staged[0]["rows"] > loaded
+
+    touch("listings.csv")
+    store.reload()
+    assert len(store.current.listings) == merged
+    assert len(os.listdir("uploads/merged")) == 1
+
+
+def test_reload_catches_up_with_merge_during_load(store):
+    # a reload that listed the merged uploads before this merge
+    loading = load_dataset(*store.files, store.merged_dir)
+    store.merge(staged_upload())
+    merged = len(store.current.listings)
+
+    store.update(lambda current: loading.catch_up(current))
+    assert len(store.current.listings) == merged
+
+
+def test_database_merge_is_not_a_source_change(store):
+    build_listings_db("listings.csv", "listings.db")
+    db_store = DatasetStore("stats.csv", "listings.db", "uploads/merged")
+    loaded = len(db_store.current.listings)
+    staged = staged_upload()
+    db_store.merge(staged)
+    assert len(db_store.current.listings) == loaded + staged[0]["rows"]
+    # the watcher compares the files with these, so it does not reload
+    assert db_store.current.sources == source_state(db_store.files)
+    assert not os.path.exists("uploads/merged")
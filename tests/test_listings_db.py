@@ -0,0 +1,122 @@
+# import libraries
+import pandas as pd
+import pytest
+
+from listings_db import ListingsDB, build_listings_db
+from listings_frame import FrameListings, ListingsFrame
+from schema import listing_table_columns
+from snapshot import load_listings
+from synthetic import write_listings
+
+TODAY = pd.Timestamp("2026-06-30")
+NOW = pd.Timestamp("2026-06-15 12:00")
+
+
+@pytest.fixture(scope="module")
+def backends(tmp_path_factory):
+    out = tmp_path_factory.mktemp("listings")
+    csv = str(out / "listings.csv")
+    write_listings(csv, 3000, today=TODAY)
+    build_listings_db(csv, str(out / "listings.db"))
+    db = ListingsDB(str(out / "listings.db"))
+    yield db, ListingsFrame(load_listings(csv))
+    db.close()
+
+
+# the largest broker and a small one, as (db listings, frame listings)
+@pytest.fixture(params=[0, -1], ids=["largest", "small"])
+def broker(request, backends):
+    db, frame = backends
+    counts = frame.broker_counts()
+    broker = list(counts)[request.param]
+    return db.broker(broker, counts[broker]), FrameListings(frame.broker(broker))
+
+
+def assert_same_rows(db_rows, frame_rows):
+    pd.testing.assert_frame_equal(
+        db_rows.reset_index(drop=True),
+        frame_rows.reset_index(drop=True),
+        check_dtype=False,
+        check_categorical=False,
+    )
+
+
+def zips(backends):
+    return sorted(backends[1].df["zip_code"].dropna().astype(str).unique())
+
+
+def test_broker_counts(backends):
+    db, frame = backends
+    assert len(db) == len(frame.df)
+    assert db.broker_counts() == frame.broker_counts()
+
+
+@pytest.mark.parametrize("sort", [False, True])
+def test_filter_and_count(backends, broker, sort):
+    db, frame = broker
+    for price, bed, bath, selected in [
+        (2e6, 1, 1, zips(backends)),
+        (400000, 3, 2, zips(backends)[:10]),
+    ]:
+        columns = listing_table_columns + ["links"]
+        assert_same_rows(
+            db.filter(price, bed, bath, selected, sort)[columns],
+            frame.filter(price, bed, bath, selected, sort)[columns],
+        )
+        assert db.count(price, bed, bath, selected) == frame.count(
+            price, bed, bath, selected
+        )
+
+
+@pytest.mark.parametrize(
+    "column, desc", [(None, False), ("price", False), ("bed", True), ("city", False)]
+)
+def test_page(backends, broker, column, desc):
+    db, frame = broker
+    for offset in [0, 10]:
+        args = (2e6, 1, 1, zips(backends), offset, 10, column, desc)
+        assert_same_rows(db.page(*args), frame.page(*args))
+
+
+@pytest.mark.parametrize(
+    "date_column, freq", [("date_sold", "M"), ("date_published", "W")]
+)
+def test_period_sales(broker, date_column, freq):
+    db, frame = broker
+    start = pd.Timestamp("2025-07-01")
+    # periods without sales may be left out, the sales chart fills them with 0
+    window = pd.period_range(start, NOW, freq=freq)
+    pd.testing.assert_series_equal(
+        db.period_sales(date_column, freq, start, NOW).reindex(window, fill_value=0),
+        frame.period_sales(date_column, freq, start, NOW).reindex(
+            window, fill_value=0
+        ),
+    )
+
+
+def test_kpis(broker):
+    db, frame = broker
+    assert db.kpis(NOW) == pytest.approx(frame.kpis(NOW), nan_ok=True)
+
+
+@pytest.mark.parametrize(
+    "status, date_column", [("sold", "date_sold"), ("for_sale", "date_published")]
+)
+def test_latest(broker, status, date_column):
+    db, frame = broker
+    columns = ["price", "zip_code"]
+    # rows with the same date may come in either order, the dates may not
+    assert_same_rows(
+        db.latest(status, date_column, columns)[[date_column]],
+        frame.latest(status, date_column, columns)[[date_column]],
+    )
+
+
+def test_frame(broker):
+    db, frame = broker
+    columns = ["price", "city"]
+    # in any row order
+    assert_same_rows(
+        db.frame(columns)[columns].sort_values(columns),
+        frame.frame(columns)[columns].sort_values(columns),
+    )
@@ -0,0 +1,54 @@
+# import libraries
+import numpy as np
+
+from cache import LRUCache, frame_version
+
+# LOWESS trendlines for the median price chart. a trendline only depends on the
+# (zip codes, metric) series, so each one is fitted once per stats frame and
+# then reused for every chart that shows it
+
+# same smoothing as px.scatter(..., trendline="lowess")
+LOWESS_FRAC = 0.6666666
+
+price_metrics = [
+    "median_listing_price",
+    "median_listing_price_mm",
+    "median_listing_price_yy",
+]
+
+trendline_cache = LRUCache(maxsize=1024, name="trendline")
+
+
+def fit_lowess(df, col_chosen, zip_codes):
+    # statsmodels is only needed once a trendline is actually fitted
+    import statsmodels.api as sm
+
+    series = df.loc[
+        df["postal_code"].isin(zip_codes), ["month_date_yyyymm", col_chosen]
+    ].sort_values("month_date_yyyymm")
+    dates = series["month_date_yyyymm"].to_numpy()
+    y = series[col_chosen].to_numpy(dtype="float64")
+    # epoch seconds, as plotly express does for datetime x values
+    x = dates.astype("datetime64[ns]").astype(np.int64) / 10**9
+
+    non_missing = ~(np.isnan(x) | np.isnan(y))
+    if non_missing.sum() < 2:
+        return dates[:0], y[:0]
+    fitted = sm.nonparametric.lowess(y, x, missing="drop", frac=LOWESS_FRAC)[:, 1]
+    return dates[non_missing], fitted
+
+
+# (dates, fitted values) of the trendline over the given zip codes
+def trendline(df, col_chosen, zip_codes):
+    zip_codes = tuple(sorted(str(z) for z in zip_codes))
+    key = (frame_version(df), col_chosen, zip_codes)
+    return trendline_cache.get_or_compute(
+        key, lambda: fit_lowess(df, col_chosen, zip_codes)
+    )
+
+
+# fit every single zip trendline up front, e.g. right after loading the data
+def precompute_trendlines(df, metrics=price_metrics):
+    for zip_code in df["postal_code"].unique():
+        for col in metrics:
+            trendline(df, col, [zip_code])
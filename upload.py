@@ -0,0 +1,83 @@
+# import libraries
+import base64
+import binascii
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# parsing of files dropped on the Upload tab. dcc.Upload hands over the whole
+# file as a base64 data url; for a preview only the start of it is decoded
+
+# largest accepted upload (decoded size), UPLOAD_MAX_MB to override
+MAX_UPLOAD_BYTES = int(os.environ.get("UPLOAD_MAX_MB", 100)) * 1024 * 1024
+PREVIEW_ROWS = 10
+
+# several files of one drop are parsed side by side
+upload_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="upload")
+
+
+class UploadError(ValueError):
+    pass
+
+
+# decoded size of a base64 data url without decoding it
+def upload_size(contents):
+    start = contents.index(",") + 1
+    padding = contents[-2:].count("=")
+    return (len(contents) - start) * 3 // 4 - padding
+
+
+def decode(contents, length=None):
+    start = contents.index(",") + 1
+    end = len(contents) if length is None else min(start + length, len(contents))
+    try:
+        return base64.b64decode(contents[start:end])
+    except binascii.Error:
+        raise UploadError("The file is not valid base64 data.")
+
+
+# first rows of a csv upload, decoding a growing prefix of the file until it
+# holds enough complete lines
+def read_csv_preview(contents, nrows, prefix=256 * 1024):
+    total = len(contents) - contents.index(",") - 1
+    while True:
+        # base64 decodes in blocks of 4 characters
+        length = min(prefix - prefix % 4, total)
+        decoded = decode(contents, length)
+        if length < total:
+            # drop the last, possibly cut off line
+            decoded = decoded[: decoded.rfind(b"\n") + 1]
+        df = pd.read_csv(io.BytesIO(decoded), nrows=nrows, encoding="utf-8")
+        if len(df) >= nrows or length >= total:
+            return df
+        prefix *= 4
+
+
+# parse an upload into a DataFrame, only the first nrows when nrows is given
+def parse_upload(contents, filename, nrows=None, max_bytes=MAX_UPLOAD_BYTES):
+    size = upload_size(contents)
+    if size > max_bytes:
+        raise UploadError(
+            f"The file is {size / 1024**2:,.0f} MB, "
+            f"uploads are limited to {max_bytes / 1024**2:,.0f} MB."
+        )
+
+    if "csv" in filename:
+        if nrows is not None:
+            return read_csv_preview(contents, nrows)
+        # parse straight from the bytes, no decoded string copy
+        return pd.read_csv(io.BytesIO(decode(contents)), encoding="utf-8")
+    elif "xls" in filename:
+        # excel files are zip / ole containers and need all of their bytes
+        return pd.read_excel(io.BytesIO(decode(contents)), nrows=nrows)
+    raise UploadError("Only csv and excel files can be uploaded.")
+
+
+# run func(contents, filename, date) for every uploaded file on the thread
+# pool, results in upload order
+def map_uploads(func, list_of_contents, list_of_names, list_of_dates):
+    return list(
+        upload_executor.map(func, list_of_contents, list_of_names, list_of_dates)
+    )